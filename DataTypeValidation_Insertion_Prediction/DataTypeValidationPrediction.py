@@ -7,11 +7,11 @@ from cassandra.auth import PlainTextAuthProvider
 import os
 import json
 import csv
-import queue
+from collections import deque
 import time
 import pandas as pd
-import decimal
 from application_logging.logger import App_Logger
+from file_operations import cassandra_io, columnar_cache, schema_io
 
 
 class DbOperation:
@@ -23,6 +23,7 @@ class DbOperation:
     def __init__(self):
         self.badFilePath = os.path.join("Prediction_Raw_Files_Validated", "Bad_Raw")
         self.goodFilePath = os.path.join("Prediction_Raw_Files_Validated", "Good_Raw")
+        self.goodCachePath = os.path.join("Prediction_Raw_Files_Validated", "Good_Raw_Cache")
         self.fileFromDb = 'Prediction_FileFromDB'
         self.logger = App_Logger()
 
@@ -248,13 +249,35 @@ class DbOperation:
             log_file.close()
             return conn
 
-    def insert_into_table_good_data(self, database_name, timeout_retry=True, conc_level=5000):
+    def _load_good_file(self, file):
+        """
+                        Method Name: _load_good_file
+
+                        Description: This method loads a Good data file as a dataframe. The columnar cache written
+                                     during raw data validation is used when it is up to date, otherwise the
+                                     file is parsed again with the dtypes of the schema file.
+
+                        Output: pandas DataFrame with columns numbered from 0
+
+                        On Failure: Raise Exception
+        """
+        file_path = os.path.join(self.goodFilePath, file)
+        cache_dir = os.path.join(self.goodCachePath, file)
+        if columnar_cache.is_fresh(cache_dir, file_path):
+            return columnar_cache.load_frame(cache_dir)
+
+        return schema_io.read_csv(file_path, schema_io.load_schema('schema_prediction.json'), names=False,
+                                  sep=r'\s+')
+
+    def insert_into_table_good_data(self, database_name, timeout_retry=True, conc_level=200, batch_size=25):
 
         """
                                Method Name: insert_into_table_good_data
 
                                Description: This method inserts the Good data files from the
                                             Good_Raw folder into database tables.
+                                            conc_level is the number of batches in flight and batch_size
+                                            the maximum number of rows in a batch.
 
                                Output: connection object
 
@@ -322,53 +345,30 @@ class DbOperation:
                 insert_stm = f"INSERT INTO {database_name}.{table_name} ({cols}) VALUES ( {qmarks} )"
                 insert_prep = conn.prepare(insert_stm)
 
-                # load file into pandas
-                data = pd.read_csv(good_file_path + '/' + file, sep=r'\s+', header=None)
+                # load file into pandas, from the validation cache if possible
+                data = self._load_good_file(file)
 
-                params = zip(*[data[c] for c in range(data.shape[1])])
                 total_queries = data.shape[0]
                 # used later
                 unit_nr_range = data[0].unique().size
 
-                # set up queue and start timer
+                # start insertion
                 start = time.time()
-                future_q = queue.Queue(maxsize=conc_level)
+                total_batches = cassandra_io.bulk_insert_data(conn, insert_prep, data,
+                                                              conc_level=conc_level, batch_size=batch_size)
 
-                # start insertion
-                for value in params:
-                    value_decimal = [decimal.Decimal(str(k)) for k in value]
-                    future = conn.execute_async(insert_prep, value_decimal)
-                    try:
-                        future_q.put_nowait(future)
-                    except queue.Full:
-                        # clear queue since it's full
-                        while True:
-                            try:
-                                future_q.get_nowait().result()
-                            except queue.Empty:
-                                break
-                        future_q.put_nowait(future)
+                end = time.time()
+                self.logger.log(log_file, f"Finished uploading {file} {total_queries} rows in {total_batches} " +
+                                f"batches with a concurrency level of {conc_level} in {int(end - start)} seconds.")
 
-                else:
-                    # process the last queries in the queue
-                    while True:
-                        try:
-                            future_q.get_nowait().result()
-                        except queue.Empty:
-                            break
-
-                    end = time.time()
-                    self.logger.log(log_file, f"Finished uploading {file} {total_queries} queries with a " +
-                                    f"concurrency level of {conc_level} in {int(end - start)} seconds.")
-
-                    # now insert a metadata table too
-                    self.logger.log(log_file, f"Uploading meta data for table {table_name}.")
-                    meta_insrt = "INSERT INTO prediction_meta_data (table_name, unit_nr_range, total_rows) VALUES " + \
-                        f"('{table_name}', {unit_nr_range}, {total_queries})"
-                    meta_insrt = SimpleStatement(meta_insrt)
-
-                    conn.execute(meta_insrt)
-                    self.logger.log(log_file, "Uploaded table metadata.")
+                # now insert a metadata table too
+                self.logger.log(log_file, f"Uploading meta data for table {table_name}.")
+                meta_insrt = "INSERT INTO prediction_meta_data (table_name, unit_nr_range, total_rows) VALUES " + \
+                    f"('{table_name}', {unit_nr_range}, {total_queries})"
+                meta_insrt = SimpleStatement(meta_insrt)
+
+                conn.execute(meta_insrt)
+                self.logger.log(log_file, "Uploaded table metadata.")
 
             except (Timeout, OperationTimedOut) as timeout:
                 self.logger.log(log_file, f'Operation timed out while uploading {file} str{timeout}', )
@@ -376,7 +376,8 @@ class DbOperation:
                 conn.shutdown()
                 if timeout_retry:
                     self.logger.log(log_file, f'Retrying to upload {file}!!')
-                    return self.insert_into_table_good_data(database_name, timeout_retry=False)
+                    return self.insert_into_table_good_data(database_name, timeout_retry=False,
+                                                            conc_level=conc_level, batch_size=batch_size)
 
                 else:
                     self.logger.log(log_file, f'Operation timed out while trying to upload file. Quitting: {timeout}')
@@ -389,7 +390,8 @@ class DbOperation:
                 conn.shutdown()
                 if timeout_retry:
                     self.logger.log(log_file, f'Retrying to upload {file}!!')
-                    return self.insert_into_table_good_data(database_name, timeout_retry=False)
+                    return self.insert_into_table_good_data(database_name, timeout_retry=False,
+                                                            conc_level=conc_level, batch_size=batch_size)
 
                 else:
                     self.logger.log(log_file, f"Error: Nodes unavailable, terminating: {unavailable}")
@@ -406,12 +408,91 @@ class DbOperation:
             log_file.close()
             return conn, column_names
 
-    def selecting_data_from_table_into_csv(self, database_name, timeout_retry=True, flush=False, conc_level=500):
+    def _stream_table(self, conn, select_prep, unit_nr_range, write_page, conc_level=500):
+        """
+                        Method Name: _stream_table
+
+                        Description: This method streams a table one unit at a time to write_page.
+                                     At most conc_level unit queries are in flight, the oldest query is always
+                                     written first so the pages arrive in unit_nr order. Each result page is
+                                     passed on as it arrives, the whole table is never held in memory.
+
+                        Output: Number of rows written
+
+                        On Failure: Raise Exception
+        """
+        pending = deque()
+        total_rows = 0
+
+        def write_result(result):
+            nonlocal total_rows
+            while True:
+                page = result._current_rows
+                if len(page):
+                    write_page(page)
+                    total_rows += len(page)
+                if not result.has_more_pages:
+                    break
+                result.fetch_next_page()
+
+        for unit in range(1, unit_nr_range + 1):
+            if len(pending) >= conc_level:
+                write_result(pending.popleft().result())
+            pending.append(conn.execute_async(select_prep, (unit,), execution_profile='pandas_profile'))
+
+        while pending:
+            write_result(pending.popleft().result())
+
+        return total_rows
+
+    def _write_table_to_csv(self, conn, select_prep, unit_nr_range, file_path, columns, conc_level=500,
+                            header=False):
+        """
+                        Method Name: _write_table_to_csv
+
+                        Description: This method streams a table to a csv file in unit_nr order.
+
+                        Output: Number of rows written
+
+                        On Failure: Raise Exception
+        """
+        with open(file_path, 'w', newline='') as out:
+
+            def write_page(page):
+                nonlocal header
+                page[columns].to_csv(out, index=False, header=header)
+                header = False
+
+            return self._stream_table(conn, select_prep, unit_nr_range, write_page, conc_level=conc_level)
+
+    def _write_table_to_columnar(self, conn, select_prep, unit_nr_range, directory, columns, total_rows,
+                                 conc_level=500):
+        """
+                        Method Name: _write_table_to_columnar
+
+                        Description: This method streams a table in unit_nr order to a columnar directory,
+                                     one memory mapped .npy file per column, see file_operations.columnar_cache.
+                                     The key columns unit_nr and time_cycles are stored as integers,
+                                     the other columns as float64.
+
+                        Output: Number of rows written
+
+                        On Failure: Raise Exception
+        """
+        dtypes = {'unit_nr': 'int64', 'time_cycles': 'int64'}
+        with columnar_cache.ColumnarWriter(directory, columns, total_rows, dtypes) as writer:
+            return self._stream_table(conn, select_prep, unit_nr_range, writer.append, conc_level=conc_level)
+
+    def selecting_data_from_table_into_csv(self, database_name, timeout_retry=True, flush=False, conc_level=500,
+                                           file_format=None):
 
         """
                         Method Name: selecting_data_from_table_into_csv
                         Description: This method exports the data in GoodData table as a CSV file. in a given location.
                                     above created .
+                                    With file_format 'columnar' every table is exported to a columnar
+                                    directory instead, see file_operations.columnar_cache. None uses the
+                                    FILE_FROM_DB_FORMAT environment variable, csv by default.
                         Output: None
                         On Failure: Raise Exception
 
@@ -423,6 +504,10 @@ class DbOperation:
         table_name_list = ['goodrawdata_00' + str(k) for k in range(1, 5)]
         conn = None
         try:
+            if file_format is None:
+                file_format = columnar_cache.export_format()
+            self.logger.log(log_file, f"Tables will be exported in {file_format} format.")
+
             self.logger.log(log_file, "Connecting to database...")
             if flush:
                 self.logger.log(log_file, "Flush is True, flush old tables and initiate database insertion.")
@@ -519,52 +604,33 @@ class DbOperation:
                 select_prep.consistency_level = ConsistencyLevel.ONE  # set low consistency level
                 select_prep.fetch_size = None  # fetch all results at once disable paging
 
-                # choose file name
-                file_name = 'test_input_' + name.split('_')[1] + '.csv'
+                # choose file name, a columnar export is a directory without extension
+                file_name = 'test_input_' + name.split('_')[1]
+                if file_format == 'csv':
+                    file_name += '.csv'
                 self.logger.log(log_file, f"Writing table {name} to {file_name}")
 
-                # find the corresponding prediction data file
-
-                params = [(k,) for k in range(1, unit_nr_range+1)]
-
-                # starting writing
+                # stream the table to the file in unit_nr order
                 start = time.time()
-                future_q = queue.Queue(maxsize=conc_level)
-
-                # datafram to hold results
-                df = pd.DataFrame()
-
-                for value in params:
-                    future = conn.execute_async(select_prep, value, execution_profile='pandas_profile')
-                    try:
-                        future_q.put_nowait(future)
-                    except queue.Full:
-                        # clear queue
-                        while True:
-                            try:
-                                r = future_q.get_nowait().result()
-                                df = pd.concat([df, r._current_rows], ignore_index=True)
-                            except queue.Empty:
-                                break
-                        future_q.put_nowait(future)
-
-                while True:
-                    try:
-                        r = future_q.get_nowait().result()
-                        df = pd.concat([df, r._current_rows], ignore_index=True)
-                    except queue.Empty:
-                        break
+                if file_format == 'columnar':
+                    written_rows = self._write_table_to_columnar(conn, select_prep, unit_nr_range,
+                                                                 os.path.join(self.fileFromDb, file_name),
+                                                                 list(column_names.keys()), total_rows,
+                                                                 conc_level=conc_level)
+                else:
+                    written_rows = self._write_table_to_csv(conn, select_prep, unit_nr_range,
+                                                            os.path.join(self.fileFromDb, file_name),
+                                                            list(column_names.keys()), conc_level=conc_level)
+                end = time.time()
 
-                df = df[list(column_names.keys())]
                 self.logger.log(log_file, 'Verifying against meta data.')
-                if not df.shape[0] == total_rows:
+                if not written_rows == total_rows:
                     self.logger.log(log_file,
                                     f'Warn: Verification failed for table {name}, please check the received file.')
 
-                df.to_csv(os.path.join(self.fileFromDb, file_name), index=False, header=False)
-                end = time.time()
-                self.logger.log(log_file, f"Finished writing {name} to {file_name} in {int(end - start)} seconds.")
-
+                elapsed = max(end - start, 1e-6)
+                self.logger.log(log_file, f"Finished writing {name} to {file_name}: {written_rows} rows in " +
+                                f"{int(elapsed)} seconds ({int(written_rows / elapsed)} rows/second).")
 
             self.logger.log(log_file, "Successfully wrote all tables to csv files.")
 
@@ -575,7 +641,8 @@ class DbOperation:
                 conn.shutdown()
             if timeout_retry:
                 self.logger.log(log_file, 'Retrying write tables to csv!!')
-                return self.selecting_data_from_table_into_csv(database_name, timeout_retry=False, flush=flush)
+                return self.selecting_data_from_table_into_csv(database_name, timeout_retry=False, flush=flush,
+                                                               conc_level=conc_level, file_format=file_format)
             else:
                 self.logger.log(log_file, f'Unable to export table to csv file. Quitting: {timeout}')
                 # if conn is not None: conn.shutdown()
@@ -590,7 +657,8 @@ class DbOperation:
                 conn.shutdown()
             if timeout_retry:
                 self.logger.log(log_file, f'Retrying write tables to csv!!')
-                return self.selecting_data_from_table_into_csv(database_name, timeout_retry=False, flush=flush)
+                return self.selecting_data_from_table_into_csv(database_name, timeout_retry=False, flush=flush,
+                                                               conc_level=conc_level, file_format=file_format)
 
             else:
                 self.logger.log(log_file, f"Error: Nodes unavailable, terminating: {unavailable}")
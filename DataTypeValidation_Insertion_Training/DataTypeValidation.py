@@ -8,11 +8,11 @@ from cassandra.concurrent import execute_concurrent_with_args
 import os
 import json
 import csv
-import queue
+from collections import deque
 import time
 import pandas as pd
-import decimal
 from application_logging.logger import App_Logger
+from file_operations import cassandra_io, columnar_cache, schema_io
 
 
 class dBOperation:
@@ -24,6 +24,7 @@ class dBOperation:
     def __init__(self):
         self.badFilePath = "Training_Raw_files_validated/Bad_Raw"
         self.goodFilePath = "Training_Raw_files_validated/Good_Raw"
+        self.goodCachePath = "Training_Raw_files_validated/Good_Raw_Cache"
         self.fileFromDb = 'Training_FileFromDB/'
         self.logger = App_Logger()
 
@@ -259,13 +260,32 @@ class dBOperation:
             log_file.close()
             return conn  # column names contains the schema file
 
-    def insertIntoTableGoodData(self, Database, timeout_retry=True):
+    def loadGoodFile(self, file):
+        """
+                        Method Name: load_good_file
+                        Description: This method loads a Good data file as a dataframe. The columnar cache written
+                                    during raw data validation is used when it is up to date, otherwise the
+                                    file is parsed again with the dtypes of the schema file.
+                        Output: pandas DataFrame with columns numbered from 0
+                        On Failure: Raise Exception
+        """
+        file_path = os.path.join(self.goodFilePath, file)
+        cache_dir = os.path.join(self.goodCachePath, file)
+        if columnar_cache.is_fresh(cache_dir, file_path):
+            return columnar_cache.load_frame(cache_dir)
+
+        return schema_io.read_csv(file_path, schema_io.load_schema('schema_training.json'), names=False,
+                                  sep=r'\s+')
+
+    def insertIntoTableGoodData(self, Database, timeout_retry=True, conc_level=200, batch_size=25):
 
         """
                                Method Name: insert_into_table_good_data
 
                                Description: This method inserts the Good data files from the
                                             Good_Raw folder into database tables.
+                                            conc_level is the number of batches in flight and batch_size
+                                            the maximum number of rows in a batch.
 
                                Output: connection object
 
@@ -302,7 +322,8 @@ class dBOperation:
             conn.shutdown()
             if timeout_retry:
                 self.logger.log(log_file, 'Retrying....!')
-                return self.insertIntoTableGoodData(Database=Database, timeout_retry=False)
+                return self.insertIntoTableGoodData(Database=Database, timeout_retry=False,
+                                                    conc_level=conc_level, batch_size=batch_size)
             else:
                 error = Exception('Required metadata table not found in database.')
                 self.logger.log(log_file, f'Error: {error}')
@@ -314,7 +335,6 @@ class dBOperation:
         onlyfiles = [f for f in os.listdir(self.goodFilePath)
                      if os.path.isfile(os.path.join(self.goodFilePath, f))]
         # count = 1
-        conc_level = 5000
 
         # construct insertion query
         qmarks = ', '.join('?' * 26)
@@ -348,7 +368,8 @@ class dBOperation:
                     conn.shutdown()
                     if timeout_retry:
                         self.logger.log(log_file, 'Retrying data insertion.')
-                        return self.insertIntoTableGoodData(Database, timeout_retry=False)
+                        return self.insertIntoTableGoodData(Database, timeout_retry=False,
+                                                        conc_level=conc_level, batch_size=batch_size)
                     else:
                         self.logger.log(log_file, 'Aborting!')
                         raise error
@@ -357,53 +378,30 @@ class dBOperation:
                 insert_stm = f"INSERT INTO {Database}.{table_name} ({cols}) VALUES ( {qmarks} )"
                 insert_prep = conn.prepare(insert_stm)
 
-                # load file into pandas
-                data = pd.read_csv(goodFilePath + '/' + file, sep=r'\s+', header=None)
+                # load file into pandas, from the validation cache if possible
+                data = self.loadGoodFile(file)
 
-                params = zip(*[data[c] for c in range(data.shape[1])])
                 total_queries = data.shape[0]
                 # used later
                 unit_nr_range = data[0].unique().size
 
-                # set up queue and start timer
+                # start insertion
                 start = time.time()
-                future_q = queue.Queue(maxsize=conc_level)
+                total_batches = cassandra_io.bulk_insert_data(conn, insert_prep, data,
+                                                              conc_level=conc_level, batch_size=batch_size)
 
-                # start insertion
-                for value in params:
-                    value_decimal = [decimal.Decimal(str(k)) for k in value]
-                    future = conn.execute_async(insert_prep, value_decimal)
-                    try:
-                        future_q.put_nowait(future)
-                    except queue.Full:
-                        # clear queue since it's full
-                        while True:
-                            try:
-                                future_q.get_nowait().result()
-                            except queue.Empty:
-                                break
-                        future_q.put_nowait(future)
+                end = time.time()
+                self.logger.log(log_file, f"Finished uploading {file} {total_queries} rows in {total_batches} " +
+                                f"batches with a concurrency level of {conc_level} in {int(end - start)} seconds.")
 
-                else:
-                    # process the last queries in the queue
-                    while True:
-                        try:
-                            future_q.get_nowait().result()
-                        except queue.Empty:
-                            break
-
-                    end = time.time()
-                    self.logger.log(log_file, f"Finished uploading {file} {total_queries} queries with a " +
-                                    f"concurrency level of {conc_level} in {int(end - start)} seconds.")
-
-                    # now insert a metadata table too
-                    self.logger.log(log_file, f"Uploading meta data for table {table_name}.")
-                    meta_insrt = "INSERT INTO training_meta_data (table_name, unit_nr_range, total_rows) VALUES " + \
-                        f"('{table_name}', {unit_nr_range}, {total_queries})"
-                    meta_insrt = SimpleStatement(meta_insrt)
-
-                    conn.execute(meta_insrt)
-                    self.logger.log(log_file, "Uploaded table metadata.")
+                # now insert a metadata table too
+                self.logger.log(log_file, f"Uploading meta data for table {table_name}.")
+                meta_insrt = "INSERT INTO training_meta_data (table_name, unit_nr_range, total_rows) VALUES " + \
+                    f"('{table_name}', {unit_nr_range}, {total_queries})"
+                meta_insrt = SimpleStatement(meta_insrt)
+
+                conn.execute(meta_insrt)
+                self.logger.log(log_file, "Uploaded table metadata.")
 
             except (Timeout, OperationTimedOut) as timeout:
                 self.logger.log(log_file, f'Operation timed out while uploading {file} str{timeout}', )
@@ -411,7 +409,8 @@ class dBOperation:
                 conn.shutdown()
                 if timeout_retry:
                     self.logger.log(log_file, f'Retrying to upload {file}!!')
-                    return self.insertIntoTableGoodData(Database, timeout_retry=False)
+                    return self.insertIntoTableGoodData(Database, timeout_retry=False,
+                                                        conc_level=conc_level, batch_size=batch_size)
 
                 else:
                     self.logger.log(log_file, f'Operation timed out while trying to upload file. Quitting: {timeout}')
@@ -424,7 +423,8 @@ class dBOperation:
                 conn.shutdown()
                 if timeout_retry:
                     self.logger.log(log_file, f'Retrying to upload {file}!!')
-                    return self.insertIntoTableGoodData(Database, timeout_retry=False)
+                    return self.insertIntoTableGoodData(Database, timeout_retry=False,
+                                                        conc_level=conc_level, batch_size=batch_size)
 
                 else:
                     self.logger.log(log_file, f"Error: Nodes unavailable, terminating: {unavailable}")
@@ -441,12 +441,81 @@ class dBOperation:
             log_file.close()
             return conn, column_names
 
-    def selectingDatafromtableintocsv(self, Database, timeout_retry=True, flush=True):
+    def streamTable(self, conn, select_prep, unit_nr_range, write_page, conc_level=1000):
+        """
+                        Method Name: streamTable
+                        Description: This method streams a table one unit at a time to write_page.
+                                    At most conc_level unit queries are in flight, the oldest query is always
+                                    written first so the pages arrive in unit_nr order. Each result page is
+                                    passed on as it arrives, the whole table is never held in memory.
+                        Output: Number of rows written
+                        On Failure: Raise Exception
+        """
+        pending = deque()
+        total_rows = 0
+
+        def write_result(result):
+            nonlocal total_rows
+            while True:
+                page = result._current_rows
+                if len(page):
+                    write_page(page)
+                    total_rows += len(page)
+                if not result.has_more_pages:
+                    break
+                result.fetch_next_page()
+
+        for unit in range(1, unit_nr_range + 1):
+            if len(pending) >= conc_level:
+                write_result(pending.popleft().result())
+            pending.append(conn.execute_async(select_prep, (unit,), execution_profile='pandas_profile'))
+
+        while pending:
+            write_result(pending.popleft().result())
+
+        return total_rows
+
+    def writeTableToCsv(self, conn, select_prep, unit_nr_range, file_path, columns, conc_level=1000, header=True):
+        """
+                        Method Name: write_table_to_csv
+                        Description: This method streams a table to a csv file in unit_nr order.
+                        Output: Number of rows written
+                        On Failure: Raise Exception
+        """
+        with open(file_path, 'w', newline='') as out:
+
+            def write_page(page):
+                nonlocal header
+                page[columns].to_csv(out, index=False, header=header)
+                header = False
+
+            return self.streamTable(conn, select_prep, unit_nr_range, write_page, conc_level=conc_level)
+
+    def writeTableToColumnar(self, conn, select_prep, unit_nr_range, directory, columns, total_rows,
+                             conc_level=1000):
+        """
+                        Method Name: writeTableToColumnar
+                        Description: This method streams a table in unit_nr order to a columnar directory,
+                                    one memory mapped .npy file per column, see file_operations.columnar_cache.
+                                    The key columns unit_nr and time_cycles are stored as integers,
+                                    the other columns as float64.
+                        Output: Number of rows written
+                        On Failure: Raise Exception
+        """
+        dtypes = {'unit_nr': 'int64', 'time_cycles': 'int64'}
+        with columnar_cache.ColumnarWriter(directory, columns, total_rows, dtypes) as writer:
+            return self.streamTable(conn, select_prep, unit_nr_range, writer.append, conc_level=conc_level)
+
+    def selectingDatafromtableintocsv(self, Database, timeout_retry=True, flush=True, conc_level=1000,
+                                      file_format=None):
 
         """
                         Method Name: selecting_data_from_table_into_csv
                         Description: This method exports the data in GoodData table as a CSV file. in a given location.
                                     above created .
+                                    With file_format 'columnar' every table is exported to a columnar
+                                    directory instead, see file_operations.columnar_cache. None uses the
+                                    FILE_FROM_DB_FORMAT environment variable, csv by default.
                         Output: None
                         On Failure: Raise Exception
 
@@ -458,6 +527,10 @@ class dBOperation:
         table_name_list = ['goodrawdata_00' + str(k) for k in range(1, 5)]
         conn = None
         try:
+            if file_format is None:
+                file_format = columnar_cache.export_format()
+            self.logger.log(log_file, f"Tables will be exported in {file_format} format.")
+
             self.logger.log(log_file, "Connecting to database...")
             if flush:
                 self.logger.log(log_file, "Flush is True, flush old tables and initiate database insertion.")
@@ -554,53 +627,33 @@ class dBOperation:
                 select_prep.consistency_level = ConsistencyLevel.ONE  # set low consistency level
                 select_prep.fetch_size = None  # fetch all results at once disable paging
 
-                # choose file name
-                file_name = 'train_input_' + name.split('_')[1] + '.csv'
+                # choose file name, a columnar export is a directory without extension
+                file_name = 'train_input_' + name.split('_')[1]
+                if file_format == 'csv':
+                    file_name += '.csv'
                 self.logger.log(log_file, f"Writing table {name} to {file_name}")
 
-                # find the corresponding training data file
-
-                conc_level = 1000
-
-                params = [(k,) for k in range(1, unit_nr_range+1)]
-
-                # starting writing
+                # stream the table to the file in unit_nr order
                 start = time.time()
-                future_q = queue.Queue(maxsize=conc_level)
+                if file_format == 'columnar':
+                    written_rows = self.writeTableToColumnar(conn, select_prep, unit_nr_range,
+                                                             os.path.join(self.fileFromDb, file_name),
+                                                             list(column_names.keys()), total_rows,
+                                                             conc_level=conc_level)
+                else:
+                    written_rows = self.writeTableToCsv(conn, select_prep, unit_nr_range,
+                                                        os.path.join(self.fileFromDb, file_name),
+                                                        list(column_names.keys()), conc_level=conc_level)
+                end = time.time()
 
-                # datafram to hold results
-                df = pd.DataFrame()
+                self.logger.log(log_file, 'Verifying against meta data.')
+                if not written_rows == total_rows:
+                    self.logger.log(log_file,
+                                    f'Warn: Verification failed for table {name}, please check the received file.')
 
-                for value in params:
-                    future = conn.execute_async(select_prep, value, execution_profile='pandas_profile')
-                    try:
-                        future_q.put_nowait(future)
-                    except queue.Full:
-                        # clear queue
-                        while True:
-                            try:
-                                r = future_q.get_nowait().result()
-                                df = pd.concat([df, r._current_rows], ignore_index=True)
-                            except queue.Empty:
-                                break
-                        future_q.put_nowait(future)
-                else:
-                    while True:
-                        try:
-                            r = future_q.get_nowait().result()
-                            df = pd.concat([df, r._current_rows], ignore_index=True)
-                        except queue.Empty:
-                            break
-
-                    df = df[list(column_names.keys())]
-                    self.logger.log(log_file, 'Verifying against meta data.')
-                    if not df.shape[0] == total_rows:
-                        self.logger.log(log_file,
-                                        f'Warn: Verification failed for table {name}, please check the received file.')
-
-                    df.to_csv(os.path.join(self.fileFromDb, file_name), index=False)
-                    end = time.time()
-                    self.logger.log(log_file, f"Finished writing {name} to {file_name} in {int(end - start)} seconds.")
+                elapsed = max(end - start, 1e-6)
+                self.logger.log(log_file, f"Finished writing {name} to {file_name}: {written_rows} rows in " +
+                                f"{int(elapsed)} seconds ({int(written_rows / elapsed)} rows/second).")
 
             else:
                 self.logger.log(log_file, "Successfully wrote all tables to csv files.")
@@ -612,7 +665,8 @@ class dBOperation:
                 conn.shutdown()
             if timeout_retry:
                 self.logger.log(log_file, f'Retrying write tables to csv!!')
-                return self.selectingDatafromtableintocsv(Database, timeout_retry=False, flush=flush)
+                return self.selectingDatafromtableintocsv(Database, timeout_retry=False, flush=flush,
+                                                          conc_level=conc_level, file_format=file_format)
             else:
                 self.logger.log(log_file, f'Unable to export table to csv file. Quitting: {timeout}')
                 # if conn is not None: conn.shutdown()
@@ -627,7 +681,8 @@ class dBOperation:
                 conn.shutdown()
             if timeout_retry:
                 self.logger.log(log_file, f'Retrying write tables to csv!!')
-                return self.selectingDatafromtableintocsv(Database, timeout_retry=False, flush=flush)
+                return self.selectingDatafromtableintocsv(Database, timeout_retry=False, flush=flush,
+                                                          conc_level=conc_level, file_format=file_format)
 
             else:
                 self.logger.log(log_file, f"Error: Nodes unavailable, terminating: {unavailable}")
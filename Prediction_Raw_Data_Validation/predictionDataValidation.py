@@ -1,3 +1,4 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from os import listdir
 import os
@@ -6,6 +7,7 @@ import json
 import shutil
 import pandas as pd
 from application_logging.logger import App_Logger
+from file_operations import columnar_cache, schema_io
 
 
 class PredictionDataValidation:
@@ -17,6 +19,9 @@ class PredictionDataValidation:
     def __init__(self, path):
         self.Batch_Directory = path
         self.schema_path = 'schema_prediction.json'
+        self.good_path = os.path.join('Prediction_Raw_Files_Validated', 'Good_Raw')
+        self.bad_path = os.path.join('Prediction_Raw_Files_Validated', 'Bad_Raw')
+        self.cache_path = os.path.join('Prediction_Raw_Files_Validated', 'Good_Raw_Cache')
         self.logger = App_Logger()
 
         # preliminary checks
@@ -148,6 +153,11 @@ class PredictionDataValidation:
                 shutil.rmtree(os.path.join(path, 'Good_Raw'))
 
                 self.logger.log(file, "GoodRaw directory deleted successfully!!!")
+
+            if os.path.isdir(os.path.join(path, 'Good_Raw_Cache')):
+                shutil.rmtree(os.path.join(path, 'Good_Raw_Cache'))
+
+                self.logger.log(file, "GoodRaw cache directory deleted successfully!!!")
             file.close()
         except OSError as s:
             file = open("Prediction_Logs/GeneralLog.txt", 'a+')
@@ -300,33 +310,65 @@ class PredictionDataValidation:
             f.close()
             raise e
 
-    def validate_column_length(self, number_of_columns):
+    def validate_single_file(self, file, number_of_columns, schema, directory=None):
+        """
+                  Method Name: validate_single_file
+
+                  Description: This function parses one file of the Good Raw Data folder (or of the given
+                               directory) exactly once with the C engine and the dtypes of the schema
+                               dict (see file_operations.schema_io), and runs
+                               the column length and the whole column missing value checks on the parsed
+                               frame. A valid file is written to the columnar cache for the database layer.
+
+                  Output: Tuple of validation result and log message
+
+                  On Failure: Exception
+
+        """
+        if directory is None:
+            directory = self.good_path
+        try:
+            csv = schema_io.read_csv(os.path.join(directory, file), schema, names=False,
+                                     sep=r'\s+', engine='c')
+        except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            return False, f"File could not be parsed with the schema data types! {e} :: {file}"
+
+        if csv.shape[1] != number_of_columns:
+            return False, f"Invalid Column Length for the file! File moved to Bad Raw Folder :: {file}"
+
+        if (csv.count() == 0).any():
+            return False, f"A column contains all NULL values! File moved to Bad Raw Folder :: {file}"
+
+        columnar_cache.save_frame(csv, os.path.join(self.cache_path, file))
+        return True, f"Column length and missing values validated for the file :: {file}"
+
+    def validate_good_raw_files(self, number_of_columns):
         """
-                          Method Name: validate_column_length
+                  Method Name: validate_good_raw_files
+
+                  Description: This function validates the files in Good Raw Data folder in a single pass.
+                               Every file is read once, invalid files are moved to Bad Raw Data folder
+                               and the parsed frames of the valid files are kept in the columnar cache,
+                               so they are not parsed again when inserted into the database.
 
-                          Description: This function validates the number of columns in the csv files.
-                                       It should be same as given in the schema file.
-                                       If not same file is not suitable for processing
-                                       and thus is moved to Bad Raw Data folder.
-                                       If the column number matches, file is kept in Good Raw Data for processing.
+                  Output: None
 
-                          Output: None
+                  On Failure: Exception
 
-                          On Failure: Exception
         """
         try:
             f = open("Prediction_Logs/columnValidationLog.txt", 'a+')
-            self.logger.log(f, "Column Length Validation Started!!")
-            good_path = os.path.join('Prediction_Raw_Files_Validated', 'Good_Raw')
-            bad_path = os.path.join('Prediction_Raw_Files_Validated', 'Bad_Raw')
-            for file in listdir(good_path):
-                csv = pd.read_csv(os.path.join(good_path, file), sep=r'\s+', header=None)
-                if csv.shape[1] == number_of_columns:
-                    self.logger.log(f, f"Column Length for the file validated :: {file}")
-                else:
-                    shutil.move(os.path.join(good_path, file), bad_path)
-                    self.logger.log(f, f"Invalid Column Length for the file!! File moved to Bad Raw Folder :: {file}")
-            self.logger.log(f, "Column Length Validation Completed!!")
+            self.logger.log(f, "Single pass Column Length and Missing Values Validation Started!!")
+            schema = schema_io.load_schema(self.schema_path)
+
+            for file in listdir(self.good_path):
+                valid, message = self.validate_single_file(file, number_of_columns, schema)
+                if not valid:
+                    shutil.move(os.path.join(self.good_path, file), self.bad_path)
+                self.logger.log(f, message)
+
+            self.logger.log(f, "Single pass Column Length and Missing Values Validation Completed!!")
+
         except OSError:
             f = open("Prediction_Logs/columnValidationLog.txt", 'a+')
             self.logger.log(f, f"Error Occurred while moving the file :: {OSError}")
@@ -340,48 +382,73 @@ class PredictionDataValidation:
         else:
             f.close()
 
-    def validate_missing_values_in_whole_column(self):
+    def validate_files_parallel(self, regex, number_of_columns, max_workers=None):
         """
-                  Method Name: validate_missing_values_in_whole_column
+                  Method Name: validate_files_parallel
 
-                  Description: This function validates if any column in the csv file has all values missing.
-                               If all the values are missing, the file is not suitable for processing.
-                               SUch files are moved to bad raw data.
+                  Description: This function validates the files of the batch directory across a pool of
+                               max_workers processes (all cores if None). The name of every file is
+                               matched with the regex, files with a valid name are parsed and checked by
+                               the workers straight from the batch directory. The workers only return
+                               their verdicts, all files are copied to Good Raw or Bad Raw Data folder
+                               in a single step once every verdict is in.
 
                   Output: None
 
                   On Failure: Exception
 
         """
-        try:
-            f = open("Prediction_Logs/missingValuesInColumn.txt", 'a+')
-            self.logger.log(f, "Missing Values Validation Started!!")
+        f = open("Prediction_Logs/nameValidationLog.txt", 'a+')
+        self.logger.log(f, "Starting parallel validation of files.")
+        self.logger.log(f, "Deleting existing good and bad raw data directories.")
+        self.delete_existing_bad_data_prediction_folder()
+        self.delete_existing_good_data_prediction_folder()
+        self.logger.log(f, "Creating new good and bad raw data directories.")
+        self.create_directory_for_good_bad_raw_data()
 
-            good_path = os.path.join('Prediction_Raw_Files_Validated', 'Good_Raw')
-            bad_path = os.path.join('Prediction_Raw_Files_Validated', 'Bad_Raw')
-            for file in listdir(good_path):
-                csv = pd.read_csv(os.path.join(good_path, file), sep=r'\s+', header=None)
-                count = 0
-                for column in csv:
-                    # if (len(csv[columns]) - csv[columns].count()) == len(csv[columns]):
-                    if csv[column].count() == 0:
-                        count += 1
-                        shutil.move(os.path.join(good_path, file), bad_path)
-                        self.logger.log(f,
-                                        f"Invalid Column Length for the file! File moved to Bad Raw Folder :: {file}")
-                        break
-
-                if count == 0:
-                    # csv.to_csv("Training_Raw_files_validated/Good_Raw/" + file, index=None, header=True)
-                    self.logger.log(f, f"No completely null columns found in file :: {file}")
+        onlyfiles = [file for file in listdir(self.Batch_Directory)
+                     if os.path.isfile(os.path.join(self.Batch_Directory, file))]
+
+        # abort if empty batch directory
+        if not onlyfiles:
+            self.logger.log(f, f"Batch directory {self.Batch_Directory} is empty. Aborting!")
+            f.close()
+            raise FileNotFoundError(f"Batch directory {self.Batch_Directory} is empty. Aborting!")
+        f.close()
+
+        try:
+            f = open("Prediction_Logs/columnValidationLog.txt", 'a+')
+            verdicts = {}
+            for filename in onlyfiles:
+                if not regex.match(filename):
+                    verdicts[filename] = (False, f"Invalid File Name! File moved to Bad Raw Folder :: {filename}")
+
+            schema = schema_io.load_schema(self.schema_path)
+            to_parse = [filename for filename in onlyfiles if filename not in verdicts]
+            self.logger.log(f, f"Validating {len(to_parse)} files with {max_workers or os.cpu_count()} processes.")
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {filename: executor.submit(self.validate_single_file, filename, number_of_columns,
+                                                     schema, self.Batch_Directory)
+                           for filename in to_parse}
+                for filename, future in futures.items():
+                    verdicts[filename] = future.result()
+
+            # move the files only after all verdicts are collected
+            for filename in onlyfiles:
+                valid, message = verdicts[filename]
+                destination = self.good_path if valid else self.bad_path
+                # copy2 keeps the modification time, so the cache written by the worker stays fresh
+                shutil.copy2(os.path.join(self.Batch_Directory, filename), destination)
+                self.logger.log(f, message)
+            self.logger.log(f, "Parallel validation of files Completed!!")
 
         except OSError:
-            f = open("Prediction_Logs/missingValuesInColumn.txt", 'a+')
+            f = open("Prediction_Logs/columnValidationLog.txt", 'a+')
             self.logger.log(f, f"Error Occurred while moving the file :: {OSError}")
             f.close()
             raise OSError
         except Exception as e:
-            f = open("Prediction_Logs/missingValuesInColumn.txt", 'a+')
+            f = open("Prediction_Logs/columnValidationLog.txt", 'a+')
             self.logger.log(f, f"Error Occurred:: {e}")
             f.close()
             raise e
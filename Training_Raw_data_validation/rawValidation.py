@@ -1,3 +1,4 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from os import listdir
 import os
@@ -6,6 +7,7 @@ import json
 import shutil
 import pandas as pd
 from application_logging.logger import App_Logger
+from file_operations import columnar_cache, schema_io
 
 
 class Raw_Data_validation:
@@ -17,6 +19,9 @@ class Raw_Data_validation:
     def __init__(self, path):
         self.Batch_Directory = path
         self.schema_path = 'schema_training.json'
+        self.good_path = 'Training_Raw_files_validated/Good_Raw'
+        self.bad_path = 'Training_Raw_files_validated/Bad_Raw'
+        self.cache_path = 'Training_Raw_files_validated/Good_Raw_Cache'
         self.logger = App_Logger()
 
         # preliminary checks
@@ -42,7 +47,7 @@ class Raw_Data_validation:
                 f.close()
             pattern = dic['SampleFileName']
             column_names = dic['ColName']
-            NumberofColumns = dic['number_of_columns']
+            NumberofColumns = dic['NumberofColumns']
 
             message = "Training file schema values loaded." + \
                       f"\tsample file name: {pattern}\tNumber of columns: {NumberofColumns}"
@@ -136,6 +141,11 @@ class Raw_Data_validation:
                 shutil.rmtree(path + 'Good_Raw/')
 
                 self.logger.log(file, "GoodRaw directory deleted successfully!!!")
+
+            if os.path.isdir(path + 'Good_Raw_Cache/'):
+                shutil.rmtree(path + 'Good_Raw_Cache/')
+
+                self.logger.log(file, "GoodRaw cache directory deleted successfully!!!")
             file.close()
         except OSError as s:
             file = open("Training_Logs/GeneralLog.txt", 'a+')
@@ -279,29 +289,56 @@ class Raw_Data_validation:
             f.close()
             raise e
 
-    def validateColumnLength(self, NumberofColumns):
+    def validateSingleFile(self, file, NumberofColumns, schema, directory=None):
         """
-                          Method Name: validate_column_length
-                          Description: This function validates the number of columns in the csv files.
-                                       It should be same as given in the schema file.
-                                       If not same file is not suitable for processing
-                                       and thus is moved to Bad Raw Data folder.
-                                       If the column number matches, file is kept in Good Raw Data for processing.
-                          Output: None
-                          On Failure: Exception
+                            Method Name: validate_single_file
+                            Description: This function parses one file of the Good Raw Data folder (or of the given
+                                        directory) exactly once with the C engine and the dtypes of the schema
+                                        dict (see file_operations.schema_io), and runs
+                                        the column length and the whole column missing value checks on the parsed
+                                        frame. A valid file is written to the columnar cache for the database layer.
+                            Output: Tuple of validation result and log message
+                            On Failure: Exception
+        """
+        if directory is None:
+            directory = self.good_path
+        try:
+            csv = schema_io.read_csv(os.path.join(directory, file), schema, names=False,
+                                     sep=r'\s+', engine='c')
+        except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            return False, "File could not be parsed with the schema data types!! %s :: %s" % (e, file)
+
+        if csv.shape[1] != NumberofColumns:
+            return False, "Invalid Column Length for the file!! File moved to Bad Raw Folder :: %s" % file
+
+        if (csv.count() == 0).any():
+            return False, "A column contains all NULL values!! File moved to Bad Raw Folder :: %s" % file
+
+        columnar_cache.save_frame(csv, os.path.join(self.cache_path, file))
+        return True, "Column length and missing values validated for the file :: %s" % file
+
+    def validateGoodRawFiles(self, NumberofColumns):
+        """
+                            Method Name: validate_good_raw_files
+                            Description: This function validates the files in Good Raw Data folder in a single pass.
+                                        Every file is read once, invalid files are moved to Bad Raw Data folder
+                                        and the parsed frames of the valid files are kept in the columnar cache,
+                                        so they are not parsed again when inserted into the database.
+                            Output: None
+                            On Failure: Exception
         """
         try:
             f = open("Training_Logs/columnValidationLog.txt", 'a+')
-            self.logger.log(f, "Column Length Validation Started!!")
-            for file in listdir('Training_Raw_files_validated/Good_Raw/'):
-                csv = pd.read_csv("Training_Raw_files_validated/Good_Raw/" + file, sep=r'\s+', header=None)
-                if csv.shape[1] == NumberofColumns:
-                    self.logger.log(f, "Column Length for the file validated :: %s" % file)
-                else:
-                    shutil.move(
-                        "Training_Raw_files_validated/Good_Raw/" + file, "Training_Raw_files_validated/Bad_Raw")
-                    self.logger.log(f, "Invalid Column Length for the file!! File moved to Bad Raw Folder :: %s" % file)
-            self.logger.log(f, "Column Length Validation Completed!!")
+            self.logger.log(f, "Single pass Column Length and Missing Values Validation Started!!")
+            schema = schema_io.load_schema(self.schema_path)
+
+            for file in listdir(self.good_path):
+                valid, message = self.validateSingleFile(file, NumberofColumns, schema)
+                if not valid:
+                    shutil.move(os.path.join(self.good_path, file), self.bad_path)
+                self.logger.log(f, message)
+
+            self.logger.log(f, "Single pass Column Length and Missing Values Validation Completed!!")
 
         except OSError:
             f = open("Training_Logs/columnValidationLog.txt", 'a+')
@@ -316,43 +353,69 @@ class Raw_Data_validation:
         else:
             f.close()
 
-    def validateMissingValuesInWholeColumn(self):
+    def validateFilesParallel(self, regex, NumberofColumns, max_workers=None):
         """
-                            Method Name: validate_missing_values_in_whole_column
-                            Description: This function validates if any column in the csv file has all values missing.
-                                        If all the values are missing, the file is not suitable for processing.
-                                        Such files are moved to bad raw data.
+                            Method Name: validate_files_parallel
+                            Description: This function validates the files of the batch directory across a pool of
+                                        max_workers processes (all cores if None). The name of every file is
+                                        matched with the regex, files with a valid name are parsed and checked by
+                                        the workers straight from the batch directory. The workers only return
+                                        their verdicts, all files are copied to Good Raw or Bad Raw Data folder
+                                        in a single step once every verdict is in.
                             Output: None
                             On Failure: Exception
         """
+        f = open("Training_Logs/nameValidationLog.txt", 'a+')
+        self.logger.log(f, "Starting parallel validation of files.")
+        self.logger.log(f, "Deleting existing good and bad raw data directories.")
+        self.deleteExistingBadDataTrainingFolder()
+        self.deleteExistingGoodDataTrainingFolder()
+        self.logger.log(f, "Creating new good and bad raw data directories.")
+        self.createDirectoryForGoodBadRawData()
+
+        onlyfiles = [file for file in listdir(self.Batch_Directory)
+                     if os.path.isfile(os.path.join(self.Batch_Directory, file))]
+
+        # abort if empty batch directory
+        if not onlyfiles:
+            self.logger.log(f, f"Batch directory {self.Batch_Directory} is empty. Aborting!")
+            f.close()
+            raise FileNotFoundError(f"Batch directory {self.Batch_Directory} is empty. Aborting!")
+        f.close()
+
         try:
-            f = open("Training_Logs/missingValuesInColumn.txt", 'a+')
-            self.logger.log(f, "Missing Values Validation Started!!")
-
-            for file in listdir('Training_Raw_files_validated/Good_Raw/'):
-                csv = pd.read_csv("Training_Raw_files_validated/Good_Raw/" + file, sep=r'\s+', header=None)
-                count = 0
-                for column in csv:
-                    # if (len(csv[column]) - csv[column].count()) == len(csv[column]):
-                    if csv[column].count() == 0:
-                        count += 1
-                        shutil.move("Training_Raw_files_validated/Good_Raw/" + file,
-                                    "Training_Raw_files_validated/Bad_Raw")
-                        self.logger.log(f,
-                                        "A column contains all NULL values!! File moved to Bad Raw Folder :: %s" % file)
-                        break
-
-                if count == 0:
-                    # csv.to_csv("Training_Raw_files_validated/Good_Raw/" + file, index=None, header=True)
-                    self.logger.log(f, "No completely null columns found in file :: %s" % file)
+            f = open("Training_Logs/columnValidationLog.txt", 'a+')
+            verdicts = {}
+            for filename in onlyfiles:
+                if not regex.match(filename):
+                    verdicts[filename] = (False, "Invalid File Name!! File moved to Bad Raw Folder :: %s" % filename)
+
+            schema = schema_io.load_schema(self.schema_path)
+            to_parse = [filename for filename in onlyfiles if filename not in verdicts]
+            self.logger.log(f, f"Validating {len(to_parse)} files with {max_workers or os.cpu_count()} processes.")
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {filename: executor.submit(self.validateSingleFile, filename, NumberofColumns,
+                                                     schema, self.Batch_Directory)
+                           for filename in to_parse}
+                for filename, future in futures.items():
+                    verdicts[filename] = future.result()
+
+            # move the files only after all verdicts are collected
+            for filename in onlyfiles:
+                valid, message = verdicts[filename]
+                destination = self.good_path if valid else self.bad_path
+                # copy2 keeps the modification time, so the cache written by the worker stays fresh
+                shutil.copy2(os.path.join(self.Batch_Directory, filename), destination)
+                self.logger.log(f, message)
+            self.logger.log(f, "Parallel validation of files Completed!!")
 
         except OSError:
-            f = open("Training_Logs/missingValuesInColumn.txt", 'a+')
+            f = open("Training_Logs/columnValidationLog.txt", 'a+')
             self.logger.log(f, "Error Occurred while moving the file :: %s" % OSError)
             f.close()
             raise OSError
         except Exception as e:
-            f = open("Training_Logs/missingValuesInColumn.txt", 'a+')
+            f = open("Training_Logs/columnValidationLog.txt", 'a+')
             self.logger.log(f, "Error Occurred:: %s" % e)
             f.close()
             raise e
@@ -1,16 +1,60 @@
 '''
 FastAPI backend
 '''
-from fastapi import FastAPI, status
-from fastapi.responses import JSONResponse
+import os
+import json
+from contextlib import asynccontextmanager
+
+import pandas as pd
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from rq import Queue
 from rq.job import Job
-from worker import conn
-from gen_prediction import gen_prediction
-from custom_modules import FilePath, BackgroundTask, Result
+from starlette.concurrency import run_in_threadpool
+from worker import conn, async_conn
+from gen_prediction import gen_prediction, enqueue_sharded_prediction
+from predict_from_model import Prediction, MissingPipelineError
+from prediction_batcher import PredictionBatcher
+from file_operations import schema_io
+from file_operations.model_registry import registry
+from job_events import claim_job, enqueue_once, fetch_result, job_fingerprint, JobEventHub
+from custom_modules import FilePath, BackgroundTask, Result, EngineCycles, RULPrediction
+
+# media type of Arrow IPC stream request bodies of /predict
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# longest time /results waits for a job to finish before answering
+MAX_RESULT_WAIT = 60
+
+# longest time a /results/{job_id}/events stream stays open
+MAX_STREAM_WAIT = 1800
+
+# one Redis subscription to the job status notifications, shared by all the waiting clients
+job_events = JobEventHub(async_conn)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    '''
+        Load every saved model once at startup, /predict then runs on a warm model registry.
+    '''
+    await run_in_threadpool(registry.preload)
+    yield
+    await job_events.close()
+
 
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# in process predictor of /predict and the dtypes of the prediction data
+predictor = Prediction('Prediction_FileFromDB')
+dtypes = schema_io.column_dtypes(schema_io.load_schema('schema_prediction.json'))
+
+# concurrent /predict requests of a data set within PREDICT_BATCH_DELAY_MS are predicted together
+batcher = PredictionBatcher(predictor.prediction_from_frame,
+                            max_delay=float(os.getenv('PREDICT_BATCH_DELAY_MS', '5')) / 1000,
+                            max_rows=int(os.getenv('PREDICT_BATCH_ROWS', '50000')),
+                            prepare=predictor.prepare_from_frame)
 
 # set up redis queue
 q = Queue(connection=conn, default_timeout=1000)
@@ -18,14 +62,92 @@ q = Queue(connection=conn, default_timeout=1000)
 @app.post('/default', status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundTask)
 async def start_prediction(filepath: FilePath):
     '''
-        Create a prediction job and return the job id.
+        Create a prediction job and return the job id. A request identical to one queued or
+        running gets the id of that job. With shard_rows the prediction is split into jobs per file
+        and unit range, the id is that of the job merging their predictions.
     '''
-
-    job = q.enqueue_call(func=gen_prediction, args=(filepath.filepath, ), result_ttl=1000)
+    if filepath.shard_rows:
+        fingerprint = job_fingerprint(gen_prediction, (filepath.filepath, ), {'shard_rows': filepath.shard_rows})
+        try:
+            # the shards are planned from the data files, in the thread pool
+            job, _ = await run_in_threadpool(
+                claim_job, conn, fingerprint,
+                lambda job_id: enqueue_sharded_prediction(q, filepath.filepath, filepath.shard_rows, job_id=job_id))
+        except (FileNotFoundError, NotADirectoryError) as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    else:
+        job, _ = enqueue_once(q, gen_prediction, args=(filepath.filepath, ), result_ttl=1000)
     
     return {'job_id': str(job.get_id()), 'status': 'Processing'}
 
 
+def cycles_frame(cycles):
+    '''
+        Build the DataFrame of engine cycles with the dtypes of the prediction schema.
+    '''
+    data = pd.DataFrame.from_records(cycles) if isinstance(cycles, list) else cycles
+    try:
+        return data.astype({col: dtype for col, dtype in dtypes.items() if col in data.columns})
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+def arrow_frame(body):
+    '''
+        Read the DataFrame of an Arrow IPC stream request body.
+    '''
+    try:
+        import pyarrow as pa  # optional, only needed for Arrow request bodies
+    except ImportError:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail='Arrow request bodies need pyarrow installed on the server.')
+    try:
+        return pa.ipc.open_stream(body).read_pandas()
+    except pa.ArrowInvalid as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+@app.post('/predict', status_code=status.HTTP_200_OK, response_model=RULPrediction,
+          openapi_extra={'requestBody': {'content': {
+              'application/json': {'schema': EngineCycles.model_json_schema()},
+              ARROW_STREAM: {'schema': {'type': 'string', 'format': 'binary'}}}}})
+async def predict(request: Request, dataset: str = None):
+    '''
+        Predict the remaining useful life of the engine units in the request, in process.
+        The body is an EngineCycles JSON document, or an Arrow IPC stream of cycles with the
+        data set given by the dataset query parameter.
+    '''
+    body = await request.body()
+    if request.headers.get('content-type', '').startswith(ARROW_STREAM):
+        if not dataset:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail='The dataset query parameter is required for Arrow request bodies.')
+        data = cycles_frame(arrow_frame(body))
+    else:
+        try:
+            engines = EngineCycles.model_validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=e.errors(include_url=False))
+        dataset = engines.dataset
+        data = cycles_frame(engines.cycles)
+
+    if registry.load_directory(dataset) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No models found for {dataset}.')
+
+    try:
+        # predicted together with the concurrent requests of the data set, in the thread pool
+        rul = await batcher.submit(data, dataset)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except MissingPipelineError as e:
+        # the models can not serve in process predictions until they are retrained
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+    return {'dataset': dataset,
+            'predictions': [{'unit_nr': unit, 'rul': value} for unit, value in rul.items()]}
+
+
 @app.post('/fetch', status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundTask)
 async def start_fetching():
     pass
@@ -35,10 +157,14 @@ async def start_fetching():
 @app.get('/results/{job_id}', status_code=status.HTTP_200_OK, response_model=Result,
         responses={status.HTTP_202_ACCEPTED:
          {'model': BackgroundTask, 'description': 'Processing in the background'}},)
-async def get_result(job_id: str):
+async def get_result(job_id: str, wait: float = 0):
     '''
         Fetch status for a given background job by its id.
+        With wait, the response is held until the job completes or wait seconds passed.
     '''
+    if wait > 0:
+        await job_events.wait(job_id, max_wait=min(wait, MAX_RESULT_WAIT))
+
     job = Job.fetch(job_id, connection=conn)
 
     if not job.is_finished:
@@ -47,3 +173,37 @@ async def get_result(job_id: str):
 
     result = job.result
     return {'result': result}
+
+
+def server_event(event, data):
+    '''
+        Format a Server-Sent Event with a JSON payload.
+    '''
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@app.get('/results/{job_id}/events', status_code=status.HTTP_200_OK,
+         response_class=StreamingResponse,
+         responses={status.HTTP_200_OK: {'content': {'text/event-stream': {}},
+                                         'description': 'Stream of status events, then a result or error event'}})
+async def stream_result(job_id: str, timeout: float = MAX_STREAM_WAIT):
+    '''
+        Stream the status transitions of a background job as Server-Sent Events, followed by its
+        result once it finished, or an error event if it failed. The stream closes after the last
+        event, or with the last status after timeout seconds.
+    '''
+    if not await async_conn.exists(Job.key_for(job_id)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No job found with id {job_id}.')
+
+    async def stream():
+        async for job_status in job_events.events(job_id, max_wait=min(timeout, MAX_STREAM_WAIT)):
+            yield server_event('status', {'job_id': job_id, 'status': job_status})
+
+            if job_status == 'finished':
+                result = await fetch_result(async_conn, job_id)
+                yield server_event('result', {'job_id': job_id, 'result': str(result)})
+            elif job_status in ['failed', 'stopped', 'canceled', None]:
+                yield server_event('error', {'job_id': job_id, 'status': job_status})
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
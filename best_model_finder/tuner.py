@@ -1,21 +1,87 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401, enables HalvingRandomSearchCV
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV, GroupShuffleSplit, \
+    ShuffleSplit
 from xgboost import XGBRegressor
 from sklearn.metrics import mean_squared_error, r2_score
 import numpy as np
+from application_logging.logger import App_Logger
+from file_operations import file_methods
+
+
+# hyper parameter search space of every model family
+SEARCH_SPACES = {
+    'RandomForest': {"n_estimators": [10, 50, 100, 130], "max_depth": [6, 8, 10, 12],
+                     "min_samples_split": [60, 70, 80, 100], "min_samples_leaf": [30, 40, 50, 60]},
+    'XGBoost': {'learning_rate': [0.5, 0.1, 0.01, 0.001], 'max_depth': [2, 4, 5, 6, 8],
+                'n_estimators': [10, 50, 80, 100, 120]},
+}
+
+SEARCH_STRATEGIES = ('exhaustive', 'randomized', 'halving')
 
 
 class Model_Finder:
     """
                 This class shall  be used to find the model with best RMSE and R2 score.
+                n_jobs is the number of cores used by the searches, -1 for all of them.
+                search is the search strategy:
+                    exhaustive: every combination of the search space (GridSearchCV)
+                    randomized: n_iter random combinations (RandomizedSearchCV)
+                    halving: successive halving of n_iter random combinations over growing
+                             training samples (HalvingRandomSearchCV)
+                early_stopping_rounds picks the number of XGBoost rounds of the final model: it is fitted on
+                a part of the training data until the score on the held out part stops improving, then
+                refitted on all of the training data with that many rounds. None (default) disables it.
 
     """
 
-    def __init__(self,file_object,logger_object):
+    def __init__(self,file_object,logger_object,n_jobs=-1,search='exhaustive',n_iter=20,
+                 early_stopping_rounds=None,random_state=None):
+        if search not in SEARCH_STRATEGIES:
+            raise ValueError(f'Unknown search strategy {search}, expected one of {SEARCH_STRATEGIES}')
         self.file_object = file_object
         self.logger_object = logger_object
-        self.rf_model = RandomForestRegressor()
-        self.xgb_model = XGBRegressor()
+        self.n_jobs = n_jobs
+        self.search = search
+        self.n_iter = n_iter
+        self.early_stopping_rounds = early_stopping_rounds
+        self.random_state = random_state
+        # the search runs the fits in parallel, the estimators themselves use a single thread
+        self.rf_model = RandomForestRegressor(n_jobs=1)
+        self.xgb_model = XGBRegressor(n_jobs=1)
+
+    def validate_search_space(self,estimator,param_grid):
+        """
+                    Method Name: validate_search_space
+                    Description: Check that every parameter of the search space is a parameter of the estimator.
+                    Output: None
+                    On Failure: Raise ValueError
+        """
+        unknown = set(param_grid) - set(estimator.get_params())
+        if unknown:
+            raise ValueError(f'{type(estimator).__name__} has no parameters {sorted(unknown)}')
+
+    def make_search(self,estimator,param_grid):
+        """
+                    Method Name: make_search
+                    Description: Create the hyper parameter search of the configured strategy.
+                    Output: The search object, to be fitted
+                    On Failure: Raise Exception
+        """
+        self.validate_search_space(estimator, param_grid)
+        self.logger_object.log(self.file_object,
+                               f"Getting best parameter for {type(estimator).__name__} with {self.search} search.")
+
+        if self.search == 'randomized':
+            return RandomizedSearchCV(estimator, param_grid, n_iter=self.n_iter, cv=5, verbose=3,
+                                      n_jobs=self.n_jobs, random_state=self.random_state)
+        if self.search == 'halving':
+            return HalvingRandomSearchCV(estimator, param_grid, n_candidates=self.n_iter, factor=3, cv=5,
+                                         verbose=3, n_jobs=self.n_jobs, random_state=self.random_state)
+        return GridSearchCV(estimator, param_grid, cv=5, verbose=3, n_jobs=self.n_jobs)
 
     def get_best_params_for_random_forest(self,train_x,train_y):
         """
@@ -31,13 +97,8 @@ class Model_Finder:
         self.logger_object.log(self.file_object,
                                f'Entered the get_best_params_for_random_forest method of {__class__}')
         try:
-            # initializing with different combination of parameters
-            param_grid = {"n_estimators": [10, 50, 100, 130], "max_depth": [6, 8, 10, 12],
-                          "min_samples_split" : [60, 70, 80, 100], "min_samples_leaf" : [30, 40, 50, 60]}
-
-            # Creating an object of the Grid Search class
-            self.logger_object.log(self.file_object, "Getting best parameter for model with grid search.")
-            grid = GridSearchCV(estimator=self.rf_model, param_grid=param_grid, cv=5,  verbose=3,n_jobs=-1)
+            # Creating the search over the random forest search space
+            grid = self.make_search(self.rf_model, SEARCH_SPACES['RandomForest'])
             # finding the best parameters
             grid.fit(train_x, train_y)
             self.logger_object.log(self.file_object, "Estimated required paramters.")
@@ -51,7 +112,8 @@ class Model_Finder:
             # creating a new model with the best parameters
             self.logger_object.log(self.file_object, 'Training random forest regressor with best parameters.')
             rf_model = RandomForestRegressor(n_estimators=n_estimators, min_samples_leaf=min_samples_leaf,
-                                              max_depth=max_depth, min_samples_split=min_samples_split)
+                                              max_depth=max_depth, min_samples_split=min_samples_split,
+                                              n_jobs=self.n_jobs)
             # training the mew model
             rf_model.fit(train_x, train_y)
             self.logger_object.log(self.file_object, 'Training complete!')
@@ -66,13 +128,15 @@ class Model_Finder:
                                    f'Exited the get_best_params_for_random_forest method of {__class__}')
             raise e
 
-    def get_best_params_for_xgboost(self,train_x,train_y):
+    def get_best_params_for_xgboost(self,train_x,train_y,groups=None):
 
         """
                             Method Name: get_best_params_for_xgboost
 
                             Description: get the parameters for XGBoost Algorithm which give the best accuracy.
-                                         Use Hyper Parameter Tuning.
+                                         Use Hyper Parameter Tuning. With early stopping, groups are the
+                                         units of the rows: the held out rows are whole units, the cycles of
+                                         a unit never end up on both sides.
 
                             Output: The model with the best parameters
 
@@ -81,36 +145,30 @@ class Model_Finder:
         self.logger_object.log(self.file_object,
                                f'Entered the get_best_params_for_xgboost method of {__class__}')
         try:
-            # initializing with different combination of parameters
-            param_grid_xgboost = {
-
-                'learning_rate': [0.5, 0.1, 0.01, 0.001],
-                'max_depth': [2, 4, 5, 6, 8],
-                'n_estimators': [10, 50, 80, 100, 120],
-                "min_samples_split" : [50,70,100,150],
-                "min_samples_leaf" : [20,30,40,50],
-
-            }
-            # Creating an object of the Grid Search class
-
-            self.logger_object.log(self.file_object, "Getting best parameter for model with grid search.")
-            grid= GridSearchCV(self.xgb_model,param_grid_xgboost, verbose=3,cv=5,n_jobs=-1)
+            # Creating the search over the XGBoost search space
+            grid = self.make_search(self.xgb_model, SEARCH_SPACES['XGBoost'])
             # finding the best parameters
             grid.fit(train_x, train_y)
-            self.logger_object.log(self.file_object, "Grid search for parameters complete.")
-
-            # extracting the best parameters
-            learning_rate = grid.best_params_['learning_rate']
-            max_depth = grid.best_params_['max_depth']
-            n_estimators = grid.best_params_['n_estimators']
-            min_samples_split = grid.best_params_['min_samples_split']
-            min_samples_leaf = grid.best_params_['min_samples_leaf']
+            self.logger_object.log(self.file_object, "Search for parameters complete.")
 
             # creating a new model with the best parameters
             self.logger_object.log(self.file_object, 'Training XGBoost regressor with best parameters.')
-            xgb_model = XGBRegressor(learning_rate = learning_rate, max_depth=max_depth, n_estimators=n_estimators,
-                                          min_samples_split = min_samples_split, min_samples_leaf=min_samples_leaf)
-            # training the mew model
+            params = dict(grid.best_params_, n_jobs=None if self.n_jobs < 0 else self.n_jobs)
+            if self.early_stopping_rounds:
+                # n_estimators is the upper bound of the rounds, the held out units pick the number of rounds
+                if groups is None:
+                    splitter = ShuffleSplit(n_splits=1, test_size=0.1, random_state=self.random_state)
+                else:
+                    splitter = GroupShuffleSplit(n_splits=1, test_size=0.1, random_state=self.random_state)
+                fit_rows, eval_rows = next(splitter.split(train_x, train_y, groups))
+                probe = XGBRegressor(**params, early_stopping_rounds=self.early_stopping_rounds)
+                probe.fit(train_x.iloc[fit_rows], train_y.iloc[fit_rows],
+                          eval_set=[(train_x.iloc[eval_rows], train_y.iloc[eval_rows])], verbose=False)
+                params['n_estimators'] = probe.best_iteration + 1
+                self.logger_object.log(self.file_object,
+                                       f'Early stopping kept {params["n_estimators"]} boosting rounds.')
+            # training the mew model on all of the training data
+            xgb_model = XGBRegressor(**params)
             xgb_model.fit(train_x, train_y)
             self.logger_object.log(self.file_object, 'Training complete!')
             self.logger_object.log(self.file_object, f'XGBoost best params: {grid.best_params_}')
@@ -124,10 +182,12 @@ class Model_Finder:
                                    f'Exited the get_best_params_for_xgboost method of {__class__}')
             raise e
 
-    def get_best_model(self,train_x,train_y,test_x,test_y):
+    def get_best_model(self,train_x,train_y,test_x,test_y,groups=None):
         """
                             Method Name: get_best_model
                             Description: Find out the Model which has the best R2 score.
+                                         groups are the units of the training rows, see
+                                         get_best_params_for_xgboost.
                             Output: The best model name and the model object
                             On Failure: Raise Exception
 
@@ -137,7 +197,7 @@ class Model_Finder:
 
         self.logger_object.log(self.file_object, "Starting training for XGBoost regressor.")
         # create best model for XGBoost
-        xgboost= self.get_best_params_for_xgboost(train_x,train_y)
+        xgboost= self.get_best_params_for_xgboost(train_x,train_y,groups)
         self.logger_object.log(self.file_object, "Starting training for Random Forest regressor.")
         # create best model for Random Forest
         random_forest = self.get_best_params_for_random_forest(train_x, train_y)
@@ -175,3 +235,118 @@ class Model_Finder:
             self.logger_object.log(self.file_object, f'Exited the get_best_model method of {__class__}')
             raise e
 
+
+def search_model_family(family, train_x, train_y, test_x, test_y, n_jobs, search_options=None, groups=None,
+                        log_path="Training_Logs/ModelTrainingLog.txt"):
+    """
+                            Function Name: search_model_family
+                            Description: Tune one model family on one cluster and score it on the test split.
+                                         Runs inside a worker process of ParallelModelSearch, so it writes
+                                         to its own handle of the training log.
+                            Output: The tuned model, its R2 score and its RMSE
+                            On Failure: Raise Exception
+
+    """
+    with open(log_path, 'a+') as file_object:
+        model_finder = Model_Finder(file_object, App_Logger(), n_jobs=n_jobs, **(search_options or {}))
+        if family == 'XGBoost':
+            model = model_finder.get_best_params_for_xgboost(train_x, train_y, groups)
+        else:
+            model = model_finder.get_best_params_for_random_forest(train_x, train_y)
+
+        prediction = model.predict(test_x)
+        return model, r2_score(test_y, prediction), np.sqrt(mean_squared_error(test_y, prediction))
+
+
+class ParallelModelSearch:
+    """
+                This class runs the model search of every (data set, cluster, model family) task in
+                a process pool. The cores of cpu_budget are split between the max_tasks concurrent
+                tasks, so that the grid searches do not oversubscribe the machine. The best model of a
+                cluster is saved as soon as both of its model families are done.
+                search_options are passed on to Model_Finder, e.g. search='halving'.
+
+    """
+    FAMILIES = ['XGBoost', 'RandomForest']
+
+    def __init__(self, file_object, logger_object, max_tasks, cpu_budget=None, search_options=None):
+        self.file_object = file_object
+        self.logger_object = logger_object
+        self.search_options = search_options or {}
+        cpu_budget = cpu_budget or os.cpu_count()
+        self.max_tasks = max(1, min(max_tasks, cpu_budget))
+        self.task_jobs = max(1, cpu_budget // self.max_tasks)
+        # spawn fresh interpreters, forking a process that already started OpenMP threads is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=self.max_tasks, mp_context=get_context('spawn'))
+        self.pending = {}
+        self.logger_object.log(self.file_object,
+                               f'Model search pool started with {self.max_tasks} tasks of {self.task_jobs} cores.')
+
+    def submit(self, filename, cluster, train_x, train_y, test_x, test_y, groups=None):
+        """
+                            Method Name: submit
+                            Description: Queue the model search of every model family for a cluster.
+                                         groups are the units of the training rows.
+                            Output: None
+                            On Failure: Raise Exception
+
+        """
+        self.logger_object.log(self.file_object, f'Queued model search for cluster {cluster} of {filename}.')
+        self.pending[(filename, cluster)] = {
+            family: self.executor.submit(search_model_family, family, train_x, train_y,
+                                         test_x, test_y, self.task_jobs, self.search_options, groups)
+            for family in self.FAMILIES}
+
+    def save_finished(self):
+        """
+                            Method Name: save_finished
+                            Description: Save the best model of every cluster whose model searches are all done.
+                            Output: None
+                            On Failure: Raise Exception
+
+        """
+        for (filename, cluster), futures in list(self.pending.items()):
+            if not all(future.done() for future in futures.values()):
+                continue
+            del self.pending[(filename, cluster)]
+
+            scores = {}
+            for family, future in futures.items():
+                model, r2, rmse = future.result()
+                scores[family] = (r2, model)
+                self.logger_object.log(self.file_object,
+                                       f'{filename} cluster {cluster}: RMSE for {family}: {rmse}, R2 score: {r2}')
+
+            # same rule as Model_Finder.get_best_model
+            if scores['RandomForest'][0] < scores['XGBoost'][0]:
+                best_model_name = 'XGBoost'
+            else:
+                best_model_name = 'RandomForest'
+            self.logger_object.log(self.file_object,
+                                   f"Model {best_model_name} selected for cluster {cluster} of {filename}. Saving model.")
+
+            file_op = file_methods.File_Operation(self.file_object, self.logger_object, filename)
+            file_op.save_model(scores[best_model_name][1], best_model_name + str(cluster))
+
+    def wait_all(self):
+        """
+                            Method Name: wait_all
+                            Description: Wait for all queued model searches, saving models as clusters finish.
+                            Output: None
+                            On Failure: Raise Exception
+
+        """
+        while self.pending:
+            futures = [future for group in self.pending.values() for future in group.values()]
+            wait(futures, return_when=FIRST_COMPLETED)
+            self.save_finished()
+
+    def shutdown(self):
+        """
+                            Method Name: shutdown
+                            Description: Stop the worker processes, cancelling the searches not started yet.
+                            Output: None
+                            On Failure: None
+
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
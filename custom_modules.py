@@ -1,7 +1,9 @@
 '''
 This module defines Pydantic classes used by FastAPI
 '''
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
 
 
 # pydantic models for fast api
@@ -12,6 +14,8 @@ class FilePath(BaseModel):
     '''
 
     filepath: str
+    # split the prediction into jobs of at most this many rows, None for a single job
+    shard_rows: Optional[int] = None
 
 
 class BackgroundTask(BaseModel):
@@ -29,3 +33,31 @@ class Result(BaseModel):
     '''
 
     result: str
+
+
+class EngineCycles(BaseModel):
+    '''
+    Recent time cycles of one or many engine units of a data set, one dict of column values per
+    cycle with at least unit_nr, time_cycles and the sensor columns used by the models.
+    '''
+
+    dataset: str = Field(min_length=1)
+    cycles: List[Dict[str, Optional[float]]]
+
+
+class UnitRUL(BaseModel):
+    '''
+    Predicted remaining useful life of an engine unit.
+    '''
+
+    unit_nr: int
+    rul: float
+
+
+class RULPrediction(BaseModel):
+    '''
+    Predicted remaining useful life of every engine unit of a request.
+    '''
+
+    dataset: str
+    predictions: List[UnitRUL]
@@ -1,16 +1,20 @@
 '''
 This module takes care of data ingestion.
 '''
-import json
 import os
 import re
 
+import numpy as np
 import pandas as pd
 
+from file_operations import columnar_cache, schema_io
+
 
 class DataGetter:
     """
     This class shall  be used for obtaining the data files for training.
+    The files exported from the database are read either from csv files or, zero copy,
+    from the memory mapped columnar directories of file_operations.columnar_cache.
     """
     def __init__(self, file_object, logger_object,
                 mode: str='train', path: str='Training_FileFromDB'):
@@ -31,8 +35,7 @@ class DataGetter:
             error = NotADirectoryError('Loading directory does not exist, exiting.')
             self.logger_object.log(self.file_object, f'Error: {error}')
             raise error
-        if not [f for f in os.listdir(self.loading_directory)
-                  if os.path.isfile(os.path.join(self.loading_directory, f))]:
+        if not os.listdir(self.loading_directory):
             error = FileNotFoundError('Loading directory does not contain any files, exiting.')
             self.logger_object.log(self.file_object, f"Error: {error}")
             raise error
@@ -43,11 +46,56 @@ class DataGetter:
             self.logger_object.log(self.file_object, f"{error}")
             raise error
 
-        with open('schema_prediction.json', 'r', encoding='utf-8') as schema:
-            dic = json.load(schema)
-            column_names = dic['ColName']
+        # the csv files are read with the physical dtypes of the schema, see file_operations.schema_io
+        self.schema = schema_io.load_schema('schema_prediction.json')
+        self.column_names = self.schema['ColName']
+
+    def get_files(self):
+        """
+        Method Name: get_files
+
+        Description: This method lists the valid input files of the mode, csv files or columnar directories.
+
+        Output: A list of file names.
+
+        On Failure: Raise FileNotFoundError
+        """
+        if self.mode == 'train':
+            regex = re.compile(r"^train_input_00[1-4](\.csv)?$")
+        else:
+            regex = re.compile(r"^test_input_00[1-4](\.csv)?$")
+
+        self.logger_object.log(self.file_object,
+                                f"Checking all valid files in {self.loading_directory}.")
+
+        # csv files, or columnar directories without extension
+        onlyfiles = [f for f in os.listdir(self.loading_directory)
+                     if regex.match(f) and
+                     (os.path.isfile(os.path.join(self.loading_directory, f)) if f.endswith('.csv')
+                      else columnar_cache.is_frame(os.path.join(self.loading_directory, f)))]
 
-        self.column_names = column_names
+        if not onlyfiles:
+            error = FileNotFoundError(
+                        f"No valid files found in {self.loading_directory}. Quitting!")
+            self.logger_object.log(self.file_object, f"Error: {error}")
+            raise error
+        return onlyfiles
+
+    def read_file(self, file):
+        """
+        Method Name: read_file
+
+        Description: This method reads an input file, a csv file with the dtypes of the schema or
+                     a memory mapped columnar directory.
+
+        Output: A pandas DataFrame.
+
+        On Failure: Raise Exception
+        """
+        file_path = os.path.join(self.loading_directory, file)
+        if file.endswith('.csv'):
+            return schema_io.read_csv(file_path, self.schema)
+        return columnar_cache.load_frame(file_path)
 
     def get_data(self):
         """
@@ -63,32 +111,14 @@ class DataGetter:
                                 'Entered the get_data method of the Data_Getter class')
         try:
 
-            if self.mode == 'train':
-                regex = re.compile(r"^train_input_00[1-4]\.csv$")
-            else:
-                regex = re.compile(r"^test_input_00[1-4]\.csv$")
-
-            self.logger_object.log(self.file_object,
-                                    f"Checking all valid files in {self.loading_directory}.")
-
-            onlyfiles = [f for f in os.listdir(self.loading_directory)
-                         if os.path.isfile(os.path.join(self.loading_directory, f))
-                          and regex.match(f)]
-
-            if not onlyfiles:
-                error = FileNotFoundError(
-                            f"No valid files found in {self.loading_directory}. Quitting!")
-                self.logger_object.log(self.file_object, f"Error: {error}")
-                raise error
+            onlyfiles = self.get_files()
             self.logger_object.log(self.file_object,
                                     "Generating dataframe generator object for files.")
 
             # define data generator object
             def data_gen():
                 for file in onlyfiles:
-                    file_path = os.path.join(self.loading_directory, file)
-                    df = pd.read_csv(file_path, header=None, names=self.column_names.keys())
-                    yield df, file
+                    yield self.read_file(file), file
 
             self.logger_object.log(self.file_object,
                                    'Data Load Successful' + \
@@ -101,3 +131,141 @@ class DataGetter:
             self.logger_object.log(self.file_object,
                             f'Data Load Unsuccessful.Exited the get_data method of {__class__}')
             raise e
+
+    @staticmethod
+    def unit_chunks(units, row_budget):
+        """
+        Method Name: unit_chunks
+
+        Description: This method splits rows sorted by unit into chunks of whole units. A chunk holds as
+                     many units as fit in row_budget rows, and a single unit larger than the budget is
+                     a chunk of its own.
+
+        Output: A list of (start, end) row ranges.
+
+        On Failure: Raise Exception
+        """
+        units = np.asarray(units)
+        if len(units) == 0:
+            return []
+        # first row of every unit and the end of the last one
+        bounds = np.flatnonzero(np.r_[True, units[1:] != units[:-1], True])
+
+        chunks = []
+        begin = 0
+        while begin < len(units):
+            end = bounds[np.searchsorted(bounds, begin + row_budget, side='right') - 1]
+            if end <= begin:
+                end = bounds[np.searchsorted(bounds, begin, side='right')]
+            chunks.append((begin, int(end)))
+            begin = int(end)
+        return chunks
+
+    def read_csv_chunks(self, file_path, row_budget):
+        """
+        Method Name: read_csv_chunks
+
+        Description: This method reads a csv file sorted by unit_nr in chunks of whole units of at most
+                     row_budget rows. The rows of the last unit of a read are carried over to the next
+                     chunk, so at most one chunk and one read are in memory.
+
+        Output: A generator of DataFrames.
+
+        On Failure: Raise Exception
+        """
+        carry = None
+        with schema_io.read_csv(file_path, self.schema, iterator=True) as reader:
+            while True:
+                size = row_budget - (0 if carry is None else len(carry))
+                try:
+                    part = reader.get_chunk(size if size > 0 else row_budget)
+                except StopIteration:
+                    break
+                if carry is not None:
+                    part = pd.concat([carry, part])
+
+                # the last unit can continue in the next read
+                units = part['unit_nr'].to_numpy()
+                chunks = self.unit_chunks(units, row_budget)
+                *complete, (begin, _) = chunks
+                for start, end in complete:
+                    yield part.iloc[start:end]
+                carry = part.iloc[begin:]
+
+        if carry is not None and len(carry):
+            for start, end in self.unit_chunks(carry['unit_nr'].to_numpy(), row_budget):
+                yield carry.iloc[start:end]
+
+    def get_chunks(self, row_budget=100000):
+        """
+        Method Name: get_chunks
+
+        Description: This method reads the input files in chunks of whole engine units, a unit's time series
+                     is never split between chunks. A chunk has at most row_budget rows, unless a single
+                     unit is longer. The files must be sorted by unit_nr, as exported from the database.
+                     Columnar directories are sliced from their memory map without copying.
+
+        Output: A generator function yielding (DataFrame, file name), the chunks of a file in order.
+
+        On Failure: Raise Exception
+        """
+        self.logger_object.log(self.file_object,
+                                f'Entered the get_chunks method of the {__class__}')
+        try:
+            onlyfiles = self.get_files()
+            self.logger_object.log(self.file_object,
+                                    f"Generating chunk generator object for files, {row_budget} rows per chunk.")
+
+            # define chunk generator object
+            def chunk_gen():
+                for file in onlyfiles:
+                    file_path = os.path.join(self.loading_directory, file)
+                    if file.endswith('.csv'):
+                        for chunk in self.read_csv_chunks(file_path, row_budget):
+                            yield chunk, file
+                    else:
+                        df = columnar_cache.load_frame(file_path)
+                        for start, end in self.unit_chunks(df['unit_nr'].to_numpy(), row_budget):
+                            yield df.iloc[start:end], file
+
+            self.logger_object.log(self.file_object,
+                                   f'Exited the get_chunks method of the {__class__}')
+            return chunk_gen
+
+        except Exception as e:
+            self.logger_object.log(self.file_object,
+                                f'Error in get_chunks method of the Data_Getter class: {e}')
+            raise e
+
+    def get_units(self, file):
+        """
+        Method Name: get_units
+
+        Description: This method reads the unit_nr column of an input file, one value per row.
+                     Only the unit_nr column of a csv file is parsed.
+
+        Output: A numpy array of unit numbers.
+
+        On Failure: Raise Exception
+        """
+        file_path = os.path.join(self.loading_directory, file)
+        if file.endswith('.csv'):
+            return schema_io.read_csv(file_path, self.schema, usecols=['unit_nr'])['unit_nr'].to_numpy()
+        return np.asarray(columnar_cache.load_frame(file_path)['unit_nr'])
+
+    def get_rows(self, file, start, end):
+        """
+        Method Name: get_rows
+
+        Description: This method reads the rows start to end of an input file, e.g. a range of whole units
+                     found with unit_chunks. Only these rows of a csv file are parsed, a columnar
+                     directory is sliced from its memory map.
+
+        Output: A pandas DataFrame.
+
+        On Failure: Raise Exception
+        """
+        file_path = os.path.join(self.loading_directory, file)
+        if file.endswith('.csv'):
+            return schema_io.read_csv(file_path, self.schema, skip_rows=start, nrows=end - start)
+        return columnar_cache.load_frame(file_path).iloc[start:end]
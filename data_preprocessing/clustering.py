@@ -1,24 +1,128 @@
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from kneed import KneeLocator
 from file_operations import file_methods
 import os
+import threading
+
+# elbow plots still being rendered in the background
+plot_threads = []
+
+
+def render_elbow_plot(clusters, wcss, path):
+    """
+                    Function Name: render_elbow_plot
+
+                    Description: Draw the WCSS curve on its own Agg figure and save it to path.
+                                 Does not touch the global pyplot state, so it is safe in a thread.
+
+                    Output: A picture saved to path
+
+                    On Failure: Raise Exception
+
+    """
+    # imported here so that training without plots never loads matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.plot(clusters, wcss)  # creating the graph between WCSS and the number of clusters
+    axes.set_title('The Elbow Method')
+    axes.set_xlabel('Number of clusters')
+    axes.set_ylabel('WCSS')
+    figure.savefig(path)
+
+
+def wait_for_plots():
+    """
+                    Function Name: wait_for_plots
+
+                    Description: Wait for the elbow plots rendered in the background.
+
+                    Output: None
+
+                    On Failure: None
+
+    """
+    while plot_threads:
+        plot_threads.pop().join()
+
 
 class KMeansClustering:
     """
             This class shall  be used to divide the data into clusters before training.
 
+            sample_size: fit the elbow models on a subsample of this many rows, None for all rows
+            minibatch: fit the elbow models with MiniBatchKMeans instead of KMeans
+            early_stop: stop the elbow search once the curve is flat, i.e. the last two clusters added
+                        each reduced the WCSS by less than min_gain of the WCSS of one cluster
+            max_clusters: largest number of clusters tried by the elbow search
+            plot: 'background' to render the elbow plot in a thread, 'foreground' to render it
+                  before returning, None to skip it. The WCSS curve is saved in any case.
+
     """
 
-    def __init__(self, file_object, logger_object):
+    def __init__(self, file_object, logger_object, sample_size=None, minibatch=False, early_stop=True,
+                 min_gain=0.025, max_clusters=10, plot='background'):
         self.file_object = file_object
         self.logger_object = logger_object
+        self.sample_size = sample_size
+        self.minibatch = minibatch
+        self.early_stop = early_stop
+        self.min_gain = min_gain
+        self.max_clusters = max_clusters
+        self.plot = plot
+        # fitted model of every number of clusters tried by elbow_plot, reused by create_clusters
+        self.models = {}
+
+    def sample(self, data, strata=None):
+        """
+                        Method Name: sample
+
+                        Description: Take a subsample of sample_size rows of the data. If strata is given,
+                                     every stratum keeps its share of the rows.
+
+                        Output: The subsample, or the data itself if it is not larger than sample_size
+
+                        On Failure: Raise Exception
+
+        """
+        if not self.sample_size or len(data) <= self.sample_size:
+            return data
+
+        fraction = self.sample_size / len(data)
+        if strata is None:
+            return data.sample(frac=fraction, random_state=42)
+        return data.groupby(strata, group_keys=False).sample(frac=fraction, random_state=42)
 
-    def elbow_plot(self, data, filename):
+    def next_centers(self, data, model):
+        """
+                        Method Name: next_centers
+
+                        Description: Warm start centroids for one more cluster, the centroids of the model
+                                     plus the point farthest from its nearest centroid.
+
+                        Output: Array of the initial centroids
+
+                        On Failure: Raise Exception
+
+        """
+        points = np.asarray(data, dtype=float)
+        distance = model.transform(data).min(axis=1)
+        return np.vstack([model.cluster_centers_, points[np.argmax(distance)]])
+
+    def elbow_plot(self, data, filename, strata=None):
         """
                         Method Name: elbow_plot
 
                         Description: This method saves the plot to decide the optimum number of clusters to the file.
+                                     The model of every number of clusters is fitted on a subsample of the data
+                                     (see sample), warm started from the centroids of the previous model and
+                                     kept in self.models. The search stops once the curve is flat past
+                                     the knee.
 
                         Output: A picture saved to the directory
 
@@ -27,32 +131,64 @@ class KMeansClustering:
         """
         self.logger_object.log(self.file_object, f'Entered the elbow_plot method of {__class__}')
         wcss=[]  # initializing an empty list
+        self.models = {}
         try:
             self.logger_object.log(self.file_object, 'Plotting elbow plot to identify number of clusters.')
-            for i in range (1,11):
-                kmeans=KMeans(n_clusters=i,init='k-means++',random_state=42)  # initializing the KMeans object
-                kmeans.fit(data)  # fitting the data to the KMeans Algorithm
+            sample = self.sample(data, strata)
+            self.logger_object.log(self.file_object, f'Fitting elbow models on {len(sample)} of {len(data)} rows.')
+
+            for i in range (1,self.max_clusters+1):
+                # initializing the KMeans object, from the previous centroids after the first one
+                if i == 1:
+                    # a single k-means++ start, what n_init='auto' does on newer scikit-learn
+                    init, n_init = 'k-means++', 1
+                else:
+                    init, n_init = self.next_centers(sample, self.models[i-1]), 1
+
+                if self.minibatch:
+                    kmeans = MiniBatchKMeans(n_clusters=i, init=init, n_init=n_init, batch_size=1024,
+                                             random_state=42)
+                else:
+                    kmeans = KMeans(n_clusters=i, init=init, n_init=n_init, random_state=42)
+                kmeans.fit(sample)  # fitting the data to the KMeans Algorithm
+                self.models[i] = kmeans
                 wcss.append(kmeans.inertia_)
 
-            plt.plot(range(1,11),wcss)  # creating the graph between WCSS and the number of clusters
-            plt.title('The Elbow Method')
-            plt.xlabel('Number of clusters')
-            plt.ylabel('WCSS')
-            #plt.show()
+                # stop once the last two clusters hardly reduced the WCSS, the knee is behind us
+                if self.early_stop and i >= 3 and \
+                        max(wcss[-3] - wcss[-2], wcss[-2] - wcss[-1]) < self.min_gain * wcss[0]:
+                    self.logger_object.log(self.file_object, f'WCSS curve is flat, stopping at {i} clusters.')
+                    break
 
-            self.logger_object.log(self.file_object, "Saving elbow plot to preprocessing data directory.")
+            clusters = range(1, len(wcss)+1)
+            self.logger_object.log(self.file_object, "Saving WCSS curve to preprocessing data directory.")
             save_path = os.path.join('preprocessing_data/', filename)
             if not os.path.isdir(save_path):
                 os.makedirs(save_path)
 
-            plt.savefig(os.path.join(save_path,'K-Means_Elbow.PNG'))  # saving the elbow plot locally
-            self.logger_object.log(self.file_object, "Saved plot successfully.")
+            pd.DataFrame({'WCSS': wcss}, index=pd.Index(clusters, name='Number of clusters')).to_csv(
+                os.path.join(save_path, 'K-Means_WCSS.csv'))
+
+            plot_path = os.path.join(save_path,'K-Means_Elbow.PNG')
+            if self.plot == 'background':
+                self.logger_object.log(self.file_object, "Rendering elbow plot in the background.")
+                thread = threading.Thread(target=render_elbow_plot, args=(list(clusters), wcss, plot_path),
+                                          name=f'elbow-plot-{filename}')
+                thread.start()
+                plot_threads.append(thread)
+            elif self.plot:
+                render_elbow_plot(clusters, wcss, plot_path)  # saving the elbow plot locally
+                self.logger_object.log(self.file_object, "Saved plot successfully.")
             # finding the value of the optimum cluster programmatically
-            kn = KneeLocator(range(1, 11), wcss, curve='convex', direction='decreasing')
-            self.logger_object.log(self.file_object, f'The optimum number of clusters is:{kn.knee}')
+            knee = KneeLocator(clusters, wcss, curve='convex', direction='decreasing').knee
+            if knee is None:
+                # no knee on a short or straight curve, take the sharpest bend or the last fitted model
+                knee = int(np.argmax(np.diff(wcss, 2))) + 2 if len(wcss) >= 3 else len(wcss)
+                self.logger_object.log(self.file_object, 'No knee found on the WCSS curve.')
+            self.logger_object.log(self.file_object, f'The optimum number of clusters is:{knee}')
             self.logger_object.log(self.file_object, f'Exited the elbow_plot method of {__class__}')
 
-            return kn.knee
+            return knee
 
         except OSError as ose:
             self.logger_object.log(self.file_object, f'Error{ose}')
@@ -67,6 +203,7 @@ class KMeansClustering:
                                 Method Name: create_clusters
 
                                 Description: Create a new dataframe consisting of the cluster information.
+                                             Reuses the model fitted by elbow_plot for number_of_clusters.
 
                                 Output: A datframe with cluster column
 
@@ -75,9 +212,13 @@ class KMeansClustering:
         self.logger_object.log(self.file_object, f'Entered the create_clusters method of {__class__}')
         try:
             self.logger_object.log(self.file_object, "Creating optimum number of clusters from data.")
-            kmeans = KMeans(n_clusters=number_of_clusters, init='k-means++', random_state=42)
-
-            y_kmeans = kmeans.fit_predict(data)  # divide data into clusters
+            kmeans = self.models.get(number_of_clusters)
+            if kmeans is None:
+                kmeans = KMeans(n_clusters=number_of_clusters, init='k-means++', random_state=42)
+                y_kmeans = kmeans.fit_predict(data)  # divide data into clusters
+            else:
+                self.logger_object.log(self.file_object, "Reusing the model fitted by the elbow search.")
+                y_kmeans = kmeans.predict(data)  # divide data into clusters
 
             self.logger_object.log(self.file_object, "Saving the KMeans cluster model.")
 
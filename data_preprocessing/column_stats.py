@@ -0,0 +1,141 @@
+'''
+This module computes the column statistics used by the preprocessing in a single pass over the data.
+'''
+import numpy as np
+import pandas as pd
+
+
+class ColumnStats:
+    """
+        This class holds the count, null count, mean, variance, min and max of every numeric column of
+        a DataFrame. The statistics of a frame are computed over one float matrix of its values, and
+        frames read in chunks are merged with the parallel form of Welford's algorithm, so the result
+        does not depend on how the data was chunked.
+
+        """
+
+    def __init__(self):
+        self.columns = None
+        self.rows = 0
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def from_frame(cls, data):
+        '''
+        This method computes the statistics of a DataFrame.
+
+        :param data: DataFrame
+        :return: ColumnStats
+        '''
+        stats = cls()
+        stats.update(data)
+        return stats
+
+    def update(self, data):
+        '''
+        This method adds the rows of a chunk to the statistics. Non numeric columns are ignored,
+        the chunks must have the numeric columns of the first one.
+
+        :param data: DataFrame
+        :return: self
+        '''
+        numeric = data.select_dtypes('number')
+        columns = list(numeric.columns) if self.columns is None else self.columns
+        values = numeric[columns].to_numpy(dtype='float64')
+
+        chunk = ColumnStats()
+        chunk.columns = columns
+        chunk.rows = values.shape[0]
+        valid = ~np.isnan(values)
+        chunk.count = valid.sum(axis=0).astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk.mean = np.where(valid, values, 0.0).sum(axis=0) / chunk.count
+        deviation = np.where(valid, values - chunk.mean, 0.0)
+        chunk.m2 = (deviation * deviation).sum(axis=0)
+        chunk.min = np.where(valid, values, np.inf).min(axis=0, initial=np.inf)
+        chunk.max = np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        '''
+        This method merges the statistics of other rows of the same columns into these statistics.
+
+        :param other: ColumnStats
+        :return: self
+        '''
+        if self.columns is None:
+            size = len(other.columns)
+            self.columns = list(other.columns)
+            self.count = np.zeros(size)
+            self.mean = np.zeros(size)
+            self.m2 = np.zeros(size)
+            self.min = np.full(size, np.inf)
+            self.max = np.full(size, -np.inf)
+
+        total = self.count + other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(other.count > 0, other.mean - self.mean, 0.0)
+            weight = np.where(total > 0, other.count / total, 0.0)
+            self.mean = self.mean + delta * weight
+            self.m2 = self.m2 + np.where(other.count > 0, other.m2, 0.0) + delta * delta * self.count * weight
+        self.count = total
+        self.rows += other.rows
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        return self
+
+    def select(self, columns):
+        '''
+        This method returns the statistics of the given columns, columns without statistics are skipped.
+
+        :param columns: column names
+        :return: ColumnStats
+        '''
+        positions = [self.columns.index(column) for column in columns if column in self.columns]
+        stats = ColumnStats()
+        stats.columns = [self.columns[position] for position in positions]
+        stats.rows = self.rows
+        for name in ('count', 'mean', 'm2', 'min', 'max'):
+            setattr(stats, name, getattr(self, name)[positions])
+        return stats
+
+    @property
+    def null_count(self):
+        '''
+        Number of missing values of every column.
+        '''
+        return pd.Series(self.rows - self.count, index=self.columns, dtype='int64')
+
+    @property
+    def std(self):
+        '''
+        Sample standard deviation of every column, NaN for columns with less than two values.
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+        return pd.Series(np.sqrt(variance), index=self.columns)
+
+    def is_constant(self):
+        '''
+        This method finds the columns whose values are all the same, ignoring missing values.
+
+        :return: list of column names
+        '''
+        return [column for column, low, high in zip(self.columns, self.min, self.max) if low == high]
+
+    def to_frame(self):
+        '''
+        This method returns the statistics as a DataFrame with one row per column.
+
+        :return: DataFrame
+        '''
+        with np.errstate(invalid='ignore'):
+            return pd.DataFrame({'count': self.count.astype('int64'), 'nulls': self.null_count.to_numpy(),
+                                 'mean': np.where(self.count > 0, self.mean, np.nan), 'std': self.std.to_numpy(),
+                                 'min': np.where(self.count > 0, self.min, np.nan),
+                                 'max': np.where(self.count > 0, self.max, np.nan)},
+                                index=self.columns)
@@ -1,5 +1,6 @@
 import math
 import os.path
+from datetime import datetime
 
 import numpy as np
 import pandas as pd
@@ -7,6 +8,8 @@ from pandas.api.types import is_numeric_dtype
 from sklearn.impute import KNNImputer
 from sklearn.preprocessing import StandardScaler
 
+from data_preprocessing.column_stats import ColumnStats
+
 # from imblearn.over_sampling import SMOTE
 
 class Preprocessor:
@@ -22,6 +25,9 @@ class Preprocessor:
     def __init__(self, file_object, logger_object):
         self.file_object = file_object
         self.logger_object = logger_object
+        # fitted transformers of the last impute_missing_values and scaleData calls
+        self.imputer = None
+        self.scaler = None
 
     def remove_columns(self, data, columns):
         """
@@ -64,11 +70,50 @@ class Preprocessor:
             self.logger_object.log(self.file_object, 'Label Separation Unsuccessful. Exited the separate_label_feature method of the Preprocessor class')
             raise Exception()
 
-    def is_null_present(self,data, filename):
+    def column_stats(self, data):
+        """
+            Method Name: column_stats
+
+            Description: This method computes the count, null count, mean, variance, min and max of every
+            numeric column in one pass. The statistics can be passed to is_null_present and
+            drop_columns_with_zero_std_deviation, which then do not scan the data again.
+            Output: ColumnStats
+
+            On Failure: Raise Exception
+        """
+        self.logger_object.log(self.file_object, 'Computing column statistics of the data.')
+        return ColumnStats.from_frame(data)
+
+    def write_null_report(self, null_counts, filename):
+        """
+            Method Name: write_null_report
+
+            Description: This method writes the null value count of every column to
+            preprocessing_data/<filename>/null_values.csv.
+            Output: None
+
+            On Failure: Raise Exception
+        """
+        self.logger_object.log(self.file_object, "Writing null value count to file.")
+        self.logger_object.log(self.file_object, "Creating preprocessing data directory if not present.")
+
+        # create different directory for each datafile, based on the filename
+        save_path = os.path.join('preprocessing_data/', filename)
+        if not os.path.isdir(save_path):
+            os.makedirs(save_path)
+
+        pd.DataFrame(null_counts,
+                     columns=['Missing value count']).to_csv(os.path.join(save_path, 'null_values.csv'))
+
+        self.logger_object.log(self.file_object, "Written null value count to file null_values.csv")
+
+    def is_null_present(self,data, filename, stats=None, report=True):
         """
             Method Name: is_null_present
 
             Description: This method checks whether there are null values present in the pandas Dataframe or not.
+            The null counts are taken from stats (see column_stats) when given. With report the null count
+            of every column is written by write_null_report.
             Output: Returns a Boolean Value. True if null values are present in the DataFrame,
             False if they are not present.
 
@@ -76,27 +121,21 @@ class Preprocessor:
         """
         self.logger_object.log(self.file_object, 'Entered the is_null_present method of the Preprocessor class')
         try:
+            if stats is None:
+                stats = self.column_stats(data)
+            # check for the count of null values per column, of the columns still in the data
+            null_counts = stats.null_count.reindex(data.columns, fill_value=0)
+            null_counts.name = 'Missing value count'
+
             null_present = False
-            null_counts = data.isna().sum()  # check for the count of null values per column
             for col in null_counts.index:
                 if null_counts[col] > 0:
                     null_present=True
                     self.logger_object.log(self.file_object, f"Null values present in {col} column.")
                     break
 
-            if null_present:
-                self.logger_object.log(self.file_object, "Writing null value count to file.")
-                self.logger_object.log(self.file_object, "Creating preprocessing data directory if not present.")
-
-                # create different directory for each datafile, based on the filename
-                save_path = os.path.join('preprocessing_data/', filename)
-                if not os.path.isdir(save_path):
-                    os.makedirs(save_path)
-
-                pd.DataFrame(null_counts,
-                             columns=['Missing value count']).to_csv(os.path.join(save_path, 'null_values.csv'))
-
-                self.logger_object.log(self.file_object, "Written null value count to file null_values.csv")
+            if null_present and report:
+                self.write_null_report(null_counts, filename)
 
             self.logger_object.log(self.file_object,'Exiting the is_null_present method of the Preprocessor class')
 
@@ -111,11 +150,16 @@ class Preprocessor:
             self.logger_object.log(self.file_object,'Exiting the is_null_present method of the Preprocessor class')
             raise e
 
-    def impute_missing_values(self, data):
+    def impute_missing_values(self, data, imputer=None, exclude=None, strategy='knn', groups=None):
         """
                     Method Name: impute_missing_values
 
-                    Description: This method replaces all the missing values in the Dataframe using KNN Imputer.
+                    Description: This method replaces all the missing values in the Dataframe using KNN Imputer,
+                    or one of the per unit strategies of UnitImputer ('ffill', 'interpolate', 'knn_window').
+                    A new imputer is fitted unless a fitted imputer is given, the imputer used is kept in
+                    the imputer attribute. Columns in exclude (e.g. the label) are left untouched.
+                    The per unit strategies need the unit_nr of every row, from the unit_nr column of the
+                    data or from groups.
                     Output: A Dataframe which has all the missing values imputed.
 
                     On Failure: Raise Exception
@@ -123,10 +167,32 @@ class Preprocessor:
         self.logger_object.log(self.file_object,
                                'Entered the impute_missing_values method of the Preprocessor class')
         try:
-            imputer = KNNImputer(n_neighbors=3, weights='uniform',missing_values=np.nan)
-            new_array=imputer.fit_transform(data)  # impute the missing values
-            # convert the nd-array from the step above to a Dataframe
-            new_data=pd.DataFrame(data=new_array, columns=data.columns)
+            if groups is None and 'unit_nr' in data.columns:
+                groups = data['unit_nr']
+            columns = [col for col in data.columns if exclude is None or col not in exclude]
+            fit = imputer is None
+            if fit:
+                if strategy == 'knn':
+                    imputer = KNNImputer(n_neighbors=3, weights='uniform',missing_values=np.nan)
+                else:
+                    imputer = UnitImputer(strategy)
+
+            if isinstance(imputer, UnitImputer):
+                # the index columns identify the time series, they are never imputed
+                columns = [col for col in columns if col not in PreprocessingPipeline.INDEX_COLUMNS]
+            if fit:
+                self.logger_object.log(self.file_object, f'Fitting {strategy} imputer.')
+                imputer.fit(data[columns])
+
+            # impute the missing values
+            if isinstance(imputer, UnitImputer):
+                new_array = imputer.transform(data[columns], groups)
+            else:
+                new_array = imputer.transform(data[columns])
+            # write the nd-array from the step above back to a copy of the Dataframe
+            new_data = data.copy()
+            new_data[columns] = new_array
+            self.imputer = imputer
             self.logger_object.log(self.file_object, 'Imputing missing values Successful.')
             self.logger_object.log(self.file_object,
                                    'Exited the impute_missing_values method of the Preprocessor class')
@@ -137,27 +203,33 @@ class Preprocessor:
                                    'Exiting the impute_missing_values method of the Preprocessor class ')
             raise e
 
-    def drop_columns_with_zero_std_deviation(self,data):
+    def drop_columns_with_zero_std_deviation(self,data, stats=None):
         """
                         Method Name: get_columns_with_zero_std_deviation
 
                         Description: This method finds out the columns which have a standard deviation of zero
-                        and drops them.
+                        and drops them. The statistics are taken from stats (see column_stats) when given.
 
                         On Failure: Raise Exception
 
                         :param data: DataFrame object
+                        :param stats: ColumnStats of the data, or of a frame with more columns
                         :return: cleaned DataFrame
         """
         self.logger_object.log(self.file_object,
                                'Entered the drop_columns_with_zero_std_deviation method of the Preprocessor class')
         try:
-            columns = data.columns
-            data_n = data.describe()
+            if stats is None:
+                stats = self.column_stats(data)
+            std = stats.std
+            constant = set(stats.is_constant())
             col_to_drop = []
-            for x in columns:
+            for x in data.columns:
                 # self.logger_object.log(self.file_object, f"Checking column {x} for zero standard deviation.")
-                if math.isclose(data_n.loc['std', x], 0):  # check if standard deviation is zero
+                if x not in std.index:
+                    continue
+                # check if standard deviation is zero
+                if x in constant or math.isclose(std[x], 0):
                     self.logger_object.log(self.file_object, f"Column {x} needs to be dropped.")
                     col_to_drop.append(x)  # prepare the list of columns with standard deviation zero
 
@@ -209,19 +281,21 @@ class Preprocessor:
             self.logger_object.log(self.file_object, f"Exiting drop_redundant_settings method of {__class__} class.")
             raise e
 
-    def scaleData(self, data):
+    def scaleData(self, data, scaler=None):
         '''
         Method Name: scaleData
 
         Description: This method scales the numerical columns of the given dataframe and outputs the scaled dataframe.
+        A new StandardScaler is fitted unless a fitted scaler is given, the scaler used is kept in the scaler attribute.
 
         On Failure: Raise Exception
         :param data: DataFrame
+        :param scaler: fitted StandardScaler, None to fit a new one
         :return: DataFrame with scaled numerical values
         '''
         self.logger_object.log(self.file_object, f"Starting scaleData method of {__class__} class.")
         try:
-            scalar = StandardScaler()
+            scalar = StandardScaler() if scaler is None else scaler
 
             self.logger_object.log(self.file_object, "Finding all numeric datatype columns.")
             numcol = []
@@ -233,7 +307,11 @@ class Preprocessor:
 
             num_data = data[numcol]
             # non_num_data = [col for col in data.cols and col not in num_data]
-            scaled_array = scalar.fit_transform(num_data)
+            if scaler is None:
+                scaled_array = scalar.fit_transform(num_data)
+            else:
+                scaled_array = scalar.transform(num_data)
+            self.scaler = scalar
 
             # data[numcol] = num_data
             scaled_data = pd.DataFrame(scaled_array, columns=numcol, index=data.index)
@@ -251,37 +329,51 @@ class Preprocessor:
                                    f"Exiting scaleData method of {__class__} class.")
             raise e
 
-    def add_remaining_useful_life(self, data):
+    def add_remaining_useful_life(self, data, max_rul=125, filename=None):
         '''
         Method Name: add_remaining_useful_life
 
         This methods adds the remaining useful life (RUL) column to the given dataframe.
+        The RUL of a row is the number of cycles left until the last cycle of its unit, clipped to max_rul
+        which gives the piecewise-linear target (constant at max_rul, then decreasing linearly to zero).
 
         On Failure: Raise Exception
 
         :param data: DataFrame
+        :param max_rul: clip ceiling of the RUL, 125 as we saw in EDA. None keeps the linear RUL, a dict
+                        gives one ceiling per data set keyed like drop_sensor by the last character of filename,
+                        it raises KeyError for a data set without a key
+        :param filename: name of the data file, required when max_rul is a dict
         :return: DataFrame with remaining useful life column
         '''
         self.logger_object.log(self.file_object, f"Starting add_remaining_useful_life method of {__class__} class.")
         try:
-            # find max time cycle for each unit
-            group_unit = data.groupby('unit_nr')['time_cycles']
-
-            for unit, slice in group_unit:
-                rul = slice.max() - slice
-                # clip the rul to 125 as we saw in EDA
-                rul.clip(upper=125, inplace=True)
-                data.loc[data['unit_nr'] == unit, 'RUL'] = rul
-
-            else:
-                self.logger_object.log(self.file_object, f"Successfully added remaining useful life column to data.")
-                return data
+            if isinstance(max_rul, dict):
+                if filename is None:
+                    raise ValueError("filename is required to select the RUL ceiling of the data set.")
+                if filename[-1] not in max_rul:
+                    # a None ceiling keeps the linear RUL of a data set, it has to be given explicitly
+                    raise KeyError(f"No RUL ceiling for data set {filename[-1]} of {filename} in max_rul.")
+                max_rul = max_rul[filename[-1]]
+
+            # max time cycle of the unit of each row, computed in a single groupby pass
+            last_cycle = data.groupby('unit_nr')['time_cycles'].transform('max')
+            rul = (last_cycle - data['time_cycles']).astype('float64')
+
+            if max_rul is not None:
+                rul = rul.clip(upper=max_rul)
+                self.logger_object.log(self.file_object, f"Clipped remaining useful life to {max_rul}.")
+
+            data['RUL'] = rul
+            self.logger_object.log(self.file_object, f"Successfully added remaining useful life column to data.")
+            return data
 
         except Exception as e:
             self.logger_object.log(self.file_object, f"Error occurred while adding RUL column: {e}")
             self.logger_object.log(self.file_object,
                                    f"Exiting add_remaining_useful_life method of {__class__} class.")
             raise e
+
     def drop_sensor(self,data,filename):
       """
 
@@ -320,9 +412,169 @@ class Preprocessor:
             raise e
 
 
+class PreprocessingPipeline:
+    """
+        This class holds the preprocessing fitted on the training data of one data set: the selected
+        feature columns, the imputer and one scaler per cluster. It is saved next to the models by
+        the training and applied unchanged to the prediction data.
+
+        """
+    VERSION = 1
+    INDEX_COLUMNS = ['unit_nr', 'time_cycles']
+
+    def __init__(self, feature_columns, imputer=None):
+        self.version = self.VERSION
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.feature_columns = list(feature_columns)
+        self.imputer = imputer
+        self.scalers = {}
+
+    def is_compatible(self):
+        '''
+        This method checks that the saved pipeline was created by the current version of this class.
+
+        :return: True if the pipeline can be applied
+        '''
+        return getattr(self, 'version', None) == self.VERSION
+
+    def add_scaler(self, cluster, scaler):
+        '''
+        This method stores the fitted scaler of a cluster.
+
+        :param cluster: cluster number
+        :param scaler: fitted StandardScaler
+        :return: None
+        '''
+        self.scalers[int(cluster)] = scaler
+
+    def select_columns(self, data):
+        '''
+        This method keeps the index columns present in data and the feature columns selected at training.
 
+        :param data: DataFrame
+        :return: DataFrame with the training columns
+        '''
+        index_columns = [col for col in self.INDEX_COLUMNS if col in data.columns]
+        return data[index_columns + self.feature_columns]
 
+    def impute(self, data):
+        '''
+        This method imputes the missing feature values with the imputer fitted at training.
+        A UnitImputer takes the units of the rows from the unit_nr column.
 
+        :param data: DataFrame
+        :return: DataFrame with imputed feature columns
+        '''
+        data = data.copy()
+        if isinstance(self.imputer, UnitImputer):
+            data[self.feature_columns] = self.imputer.transform(data[self.feature_columns], data['unit_nr'])
+        else:
+            data[self.feature_columns] = self.imputer.transform(data[self.feature_columns])
+        return data
 
+    def scale(self, data, cluster):
+        '''
+        This method scales the feature columns with the scaler fitted at training for the cluster.
 
+        :param data: DataFrame
+        :param cluster: cluster number
+        :return: DataFrame with scaled feature columns
+        '''
+        scaled_array = self.scalers[int(cluster)].transform(data[self.feature_columns])
+        return pd.DataFrame(scaled_array, columns=self.feature_columns, index=data.index)
 
+
+class UnitImputer:
+    """
+        This class imputes the missing sensor values of every engine unit from the unit's own time series,
+        in time linear in the number of rows. The strategies are:
+            ffill: forward fill, then backward fill within the unit
+            interpolate: linear interpolation between the valid readings of the unit, the readings before
+                         the first and after the last valid one are filled like ffill
+            knn_window: KNN imputation among the rows of the unit within window cycles of its missing rows
+        Values missing for a whole unit are filled with the column means seen by fit.
+        The rows of a unit must be consecutive and in time_cycles order.
+
+        """
+    STRATEGIES = ('ffill', 'interpolate', 'knn_window')
+
+    def __init__(self, strategy='interpolate', n_neighbors=3, window=30):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown imputation strategy {strategy}, expected one of {self.STRATEGIES}')
+        self.strategy = strategy
+        self.n_neighbors = n_neighbors
+        self.window = window
+        self.fill_values = None
+
+    def fit(self, data):
+        '''
+        This method stores the column means of the training data, used for units without any valid value.
+
+        :param data: DataFrame of the feature columns
+        :return: self
+        '''
+        self.fill_values = data.mean()
+        return self
+
+    def transform(self, data, groups):
+        '''
+        This method imputes the missing values of data.
+
+        :param data: DataFrame of the feature columns
+        :param groups: unit_nr of every row of data
+        :return: numpy array of the imputed feature columns
+        '''
+        if groups is None:
+            raise ValueError(f'The {self.strategy} imputation needs the unit_nr of every row.')
+        groups = pd.Series(np.asarray(groups), index=data.index)
+
+        if self.strategy == 'knn_window':
+            data = self._knn_window(data, groups)
+        elif self.strategy == 'interpolate':
+            data = self._interpolate(data, groups)
+
+        # the values before the first and after the last valid one of each unit
+        grouped = data.groupby(groups, sort=False)
+        data = data.fillna(grouped.ffill()).fillna(grouped.bfill())
+        return data.fillna(self.fill_values).to_numpy()
+
+    @staticmethod
+    def _interpolate(data, groups):
+        '''
+        This method interpolates linearly between valid values of the same unit. The interpolation runs
+        over the whole frame at once and is dropped wherever it bridges two units.
+        '''
+        interpolated = data.interpolate(limit_area='inside')
+        result = data.copy()
+        for column in data.columns:
+            unit_of_valid = groups.where(data[column].notna())
+            same_unit = (unit_of_valid.ffill() == groups) & (unit_of_valid.bfill() == groups)
+            result[column] = data[column].fillna(interpolated[column].where(same_unit))
+        return result
+
+    def _knn_window(self, data, groups):
+        '''
+        This method imputes the rows of the units with missing values with a KNN imputer fitted on the
+        rows of the unit within window rows of its first and last missing row.
+        '''
+        missing = data.isna().any(axis=1).to_numpy()
+        result = data.copy()
+        values = data.to_numpy(dtype='float64', copy=True)
+        # first and end row of every unit, the rows of a unit are consecutive
+        codes = pd.factorize(groups)[0]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        for unit_start, unit_end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(codes)]))):
+            unit_missing = np.flatnonzero(missing[unit_start:unit_end]) + unit_start
+            if not len(unit_missing):
+                continue
+            start = max(unit_missing[0] - self.window, unit_start)
+            end = min(unit_missing[-1] + self.window + 1, unit_end)
+            window = values[start:end]
+            # columns without a valid value in the window are left to the fill values
+            usable = ~np.isnan(window).all(axis=0)
+            if not usable.any():
+                continue
+            imputer = KNNImputer(n_neighbors=self.n_neighbors, weights='uniform', missing_values=np.nan)
+            window[:, usable] = imputer.fit_transform(window[:, usable])
+            result.iloc[start:end] = window
+        return result
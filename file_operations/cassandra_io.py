@@ -0,0 +1,98 @@
+'''
+This module writes the rows of the data files to the Cassandra tables of the training and prediction
+databases, shared by DataTypeValidation and DataTypeValidationPrediction.
+'''
+import decimal
+import threading
+
+import numpy as np
+import pandas as pd
+from cassandra.query import BatchStatement, BatchType
+
+
+def columns_to_decimal(data):
+    '''
+    This function converts every column of the dataframe to the DECIMAL wire type in one pass per column.
+    Decimal objects are built only once for each unique value of a column and then broadcast to all rows.
+
+    :param data: DataFrame of the rows of a data file
+    :return: list of numpy object arrays, one per column
+    '''
+    converted = []
+    for column in data.columns:
+        values = data[column]
+        # whole numbers parsed as float must keep their integer form, unit_nr 1.0 and 1 are
+        # different partition keys on the wire
+        if values.dtype.kind == 'f' and not values.hasnans and (values % 1 == 0).all():
+            values = values.astype('int64')
+        codes, uniques = pd.factorize(values)
+        # null values have the code -1, the last entry
+        decimals = np.array([decimal.Decimal(str(value)) for value in uniques] + [decimal.Decimal('NaN')],
+                            dtype=object)
+        converted.append(decimals[codes])
+
+    return converted
+
+
+def bulk_insert_data(conn, insert_prep, data, conc_level=200, batch_size=25):
+    '''
+    This function inserts the dataframe into the table of the prepared statement. Rows are grouped by
+    partition key (unit_nr) into unlogged batches of at most batch_size rows. At most conc_level batches
+    are in flight at any time, a semaphore slot is released by the callback of every finished batch.
+
+    :param conn: Cassandra session
+    :param insert_prep: prepared insert statement of the table
+    :param data: DataFrame of the rows, the first column is unit_nr
+    :param conc_level: largest number of batches in flight
+    :param batch_size: largest number of rows of a batch
+    :return: number of batches executed
+    '''
+    # keep all rows of a unit together, stable sort preserves the time_cycles order
+    order = np.argsort(data[0].to_numpy(), kind='stable')
+    units = data[0].to_numpy()[order]
+    columns = [col[order] for col in columns_to_decimal(data)]
+    rows = list(zip(*columns))
+
+    # split at unit boundaries and then every batch_size rows inside a unit
+    boundaries = np.flatnonzero(units[1:] != units[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(rows)]))
+
+    slots = threading.BoundedSemaphore(conc_level)
+    errors = []
+
+    def on_success(_):
+        slots.release()
+
+    def on_error(exc):
+        errors.append(exc)
+        slots.release()
+
+    total_batches = 0
+    for unit_start, unit_end in zip(starts, ends):
+        for batch_start in range(unit_start, unit_end, batch_size):
+            if errors:
+                break
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for row in rows[batch_start:min(batch_start + batch_size, unit_end)]:
+                batch.add(insert_prep, row)
+
+            slots.acquire()
+            try:
+                future = conn.execute_async(batch)
+            except Exception as e:
+                # the batch was not sent, no callback releases its slot
+                slots.release()
+                errors.append(e)
+                break
+            future.add_callbacks(callback=on_success, errback=on_error)
+            total_batches += 1
+
+    # wait for the in-flight batches to finish
+    for _ in range(conc_level):
+        slots.acquire()
+
+    if errors:
+        raise errors[0]
+
+    return total_batches
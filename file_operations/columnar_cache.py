@@ -0,0 +1,199 @@
+'''
+This module stores pandas DataFrames on disk in a columnar format, a directory
+holding one numpy .npy file per column, so that they can be read back without parsing.
+'''
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+META_FILE = 'columns.json'
+
+# formats of the files exported from the database, chosen with the FILE_FROM_DB_FORMAT environment variable
+EXPORT_FORMATS = ('csv', 'columnar')
+
+
+def export_format() -> str:
+    '''
+    This function returns the configured format of the files exported from the database.
+
+    :return: 'csv' or 'columnar'
+    '''
+    file_format = os.getenv('FILE_FROM_DB_FORMAT', 'csv').lower()
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f'FILE_FROM_DB_FORMAT must be one of {EXPORT_FORMATS}, got {file_format}')
+    return file_format
+
+
+def is_frame(directory: str) -> bool:
+    '''
+    This function checks if directory holds a DataFrame written by save_frame or ColumnarWriter.
+
+    :param directory: path to check
+    :return: True if directory is a columnar cache
+    '''
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+def save_frame(data: pd.DataFrame, directory: str):
+    '''
+    This function writes the DataFrame to directory, one .npy file per column.
+    Any existing cache in directory is replaced. The column meta data file is written last,
+    so an interrupted write never leaves a cache that looks valid.
+
+    :param data: DataFrame to store
+    :param directory: cache directory for this DataFrame
+    :return: None
+    '''
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    columns = []
+    for position, column in enumerate(data.columns):
+        file_name = f'{position:03d}.npy'
+        np.save(os.path.join(directory, file_name), data[column].to_numpy())
+        columns.append({'name': column, 'file': file_name})
+
+    with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as meta:
+        json.dump({'columns': columns, 'rows': int(data.shape[0])}, meta)
+
+
+def load_frame(directory: str, mmap: bool = True) -> pd.DataFrame:
+    '''
+    This function reads a DataFrame written by save_frame.
+
+    :param directory: cache directory of the DataFrame
+    :param mmap: memory map the column files instead of reading them into memory. The mapping is
+                 copy on write, changes to the DataFrame are never written back to the files.
+    :return: DataFrame
+    '''
+    with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as meta:
+        meta = json.load(meta)
+
+    mmap_mode = 'c' if mmap else None
+    rows = meta['rows']
+    # files written by ColumnarWriter can be longer than the rows written to them
+    arrays = {column['name']: np.load(os.path.join(directory, column['file']), mmap_mode=mmap_mode)[:rows]
+              for column in meta['columns']}
+
+    return pd.DataFrame(arrays, copy=False)
+
+
+def is_fresh(directory: str, source_path: str) -> bool:
+    '''
+    This function checks if the cache in directory exists and is not older than the source file.
+
+    :param directory: cache directory of the DataFrame
+    :param source_path: file the cache was created from
+    :return: True if the cache can be used in place of the source file
+    '''
+    meta_path = os.path.join(directory, META_FILE)
+    if not os.path.isfile(meta_path) or not os.path.isfile(source_path):
+        return False
+
+    return os.path.getmtime(meta_path) >= os.path.getmtime(source_path)
+
+
+class ColumnarWriter:
+    '''
+    This class writes a DataFrame to a columnar cache directory page by page, without holding it in memory.
+    The column files are memory mapped and preallocated for capacity rows, they grow if more rows are
+    written, like a csv file would. The column meta data file is written on a successful close only, with
+    the number of rows actually written.
+
+    :param directory: cache directory for this DataFrame, replaced if it exists
+    :param columns: names of the columns, in order
+    :param capacity: expected number of rows
+    :param dtypes: dict of column name to numpy dtype, float64 for the columns not in it
+    '''
+
+    def __init__(self, directory: str, columns, capacity: int, dtypes: dict = None):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+        self.directory = directory
+        self.columns = list(columns)
+        self.capacity = int(capacity)
+        self.rows = 0
+        dtypes = dtypes or {}
+        self.arrays = [np.lib.format.open_memmap(self.column_path(position), mode='w+',
+                                                 dtype=dtypes.get(column, 'float64'), shape=(self.capacity,))
+                       for position, column in enumerate(self.columns)]
+
+    def column_path(self, position: int) -> str:
+        '''
+        This method returns the path of the file of a column.
+
+        :param position: position of the column
+        :return: path of the .npy file
+        '''
+        return os.path.join(self.directory, f'{position:03d}.npy')
+
+    def grow(self, rows: int):
+        '''
+        This method enlarges the column files to hold at least rows rows, keeping the rows written.
+        The capacity is at least doubled, so that a table with many more rows than expected is not
+        copied for every page.
+
+        :param rows: number of rows the files must hold
+        :return: None
+        '''
+        capacity = max(rows, 2 * self.capacity, 1024)
+        arrays = []
+        while self.arrays:
+            path = self.column_path(len(arrays))
+            array = self.arrays.pop(0)
+            grown = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=array.dtype, shape=(capacity,))
+            grown[:self.rows] = array[:self.rows]
+            grown.flush()
+            # no mapping of the old file is left when it is replaced
+            del array, grown
+            os.replace(path + '.tmp', path)
+            arrays.append(np.lib.format.open_memmap(path, mode='r+'))
+        self.arrays = arrays
+        self.capacity = capacity
+
+    def append(self, data: pd.DataFrame):
+        '''
+        This method writes the rows of data after the rows already written.
+
+        :param data: DataFrame with all the columns of the writer
+        :return: None
+        '''
+        end = self.rows + len(data)
+        if end > self.capacity:
+            self.grow(end)
+
+        for column, array in zip(self.columns, self.arrays):
+            array[self.rows:end] = np.asarray(data[column], dtype=array.dtype)
+        self.rows = end
+
+    def close(self) -> int:
+        '''
+        This method flushes the column files and writes the column meta data file.
+
+        :return: number of rows written
+        '''
+        for array in self.arrays:
+            array.flush()
+        self.arrays = []
+
+        columns = [{'name': column, 'file': os.path.basename(self.column_path(position))}
+                   for position, column in enumerate(self.columns)]
+        with open(os.path.join(self.directory, META_FILE), 'w', encoding='utf-8') as meta:
+            json.dump({'columns': columns, 'rows': self.rows}, meta)
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # no meta data file, the cache is never mistaken for a complete one
+            self.arrays = []
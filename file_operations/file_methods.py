@@ -1,7 +1,8 @@
 import pickle
 import os
 import shutil
-import re
+
+from file_operations.model_registry import registry
 
 
 class File_Operation:
@@ -43,6 +44,9 @@ class File_Operation:
             with open(modelfile,'wb') as f:
                 pickle.dump(model, f) # save the model to file
 
+            # drop the cached index and models of this data set
+            registry.invalidate(self.save_directory)
+
             self.logger_object.log(self.file_object, 'Model saved successfully!')
             self.logger_object.log(self.file_object, f'Exited the save_model method of {__class__}')
 
@@ -66,26 +70,10 @@ class File_Operation:
         """
         self.logger_object.log(self.file_object, f'Entered the load_model method of {__class__}')
         try:
-            # find model directory
-            regex = re.compile(r"^train_input_00[1-4]$")
-            onlydirs = [d for d in os.listdir(self.model_directory)
-                        if os.path.isdir(os.path.join(self.model_directory, d)) and regex.match(d)]
-
-            # choose the loading directory inside models/ directory.
-            end = self.filename[-1]
-            for dir in onlydirs:
-                if dir[-1] == end:
-                    load_directory = os.path.join(self.model_directory, dir)
-                    break
-                else:
-                    continue
-            else:
-                error = Exception(f'No valid model load directory found for {self.filename}')
-                raise error
-
-            with open(os.path.join(load_directory, modelname, modelname + '.sav'), 'rb') as f:
-                self.logger_object.log(self.file_object, f"Loaded model {modelname}.")
-                return pickle.load(f)
+            # the registry indexes the model directories and caches the unpickled models
+            model = registry.load(self.filename, modelname)
+            self.logger_object.log(self.file_object, f"Loaded model {modelname}.")
+            return model
 
         except Exception as e:
             self.logger_object.log(self.file_object,
@@ -110,26 +98,13 @@ class File_Operation:
                 error = TypeError("cluster must be an integer value")
                 raise error
 
-            # find the model directory
-            regex = re.compile(r"^train_input_00[1-4]$")
-            onlydirs = [d for d in os.listdir(self.model_directory)
-                        if os.path.isdir(os.path.join(self.model_directory, d)) and regex.match(d)]
-
             # find the models save directory for this filename
-            end = self.filename[-1]
-            for dir in onlydirs:
-                if dir[-1] == end:
-                    load_directory = os.path.join(self.model_directory, dir)
-                    break
-                else:
-                    continue
-            else:
+            if registry.load_directory(self.filename) is None:
                 error = Exception(f'No valid model load directory found for cluster {self.filename}')
                 raise error
 
             # choose the model inside the models/train_input directories.
-            models = [m for m in os.listdir(load_directory)
-                      if os.path.isdir(os.path.join(load_directory, m)) and m.endswith(str(cluster))]
+            models = [m for m in registry.list_models(self.filename) if m.endswith(str(cluster))]
 
             if len(models) != 1:
                 error = Exception('More than one models found. Please check model directory for duplicates.')
@@ -0,0 +1,180 @@
+'''
+This module keeps an index of the models/ directory and a bounded LRU cache of the
+deserialized models, so that a model is unpickled only once per saved version.
+'''
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """
+        This class indexes the model directories and caches loaded models.
+        Cache entries are keyed by the model file and its modification time and size,
+        so a model saved again is never served from a stale entry.
+    """
+
+    def __init__(self, model_directory: str = 'models', maxsize: int = 32):
+        self.model_directory = model_directory
+        self.maxsize = maxsize
+        self.regex = re.compile(r"^train_input_00[1-4]$")
+        self._index = None
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _build_index(self):
+        '''
+        This method lists the model directories of every data set and the models inside them.
+
+        :return: dict of data set directory name to its modification time and list of model names
+        '''
+        index = {}
+        if os.path.isdir(self.model_directory):
+            for directory in os.listdir(self.model_directory):
+                path = os.path.join(self.model_directory, directory)
+                if os.path.isdir(path) and self.regex.match(directory):
+                    models = sorted(m for m in os.listdir(path) if os.path.isdir(os.path.join(path, m)))
+                    index[directory] = (os.stat(path).st_mtime_ns, models)
+        return index
+
+    def index(self):
+        '''
+        This method returns the index of the models directory, building it on first use.
+
+        :return: dict of data set directory name to its modification time and list of model names
+        '''
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+            return self._index
+
+    def load_directory(self, filename: str):
+        '''
+        This method finds the model directory of a data file, matching the last character of
+        the file name with the data set number of the directory.
+
+        :param filename: name of the data file, e.g. train_input_001 or test_input_001
+        :return: path of the model directory, None if there is none
+        '''
+        if not filename:
+            return None
+
+        for directory in self.index():
+            if directory[-1] == filename[-1]:
+                return os.path.join(self.model_directory, directory)
+
+        # the directory may have been created after the index was built
+        with self._lock:
+            self._index = None
+        for directory in self.index():
+            if directory[-1] == filename[-1]:
+                return os.path.join(self.model_directory, directory)
+        return None
+
+    def list_models(self, filename: str):
+        '''
+        This method lists the names of the models saved for a data file.
+
+        :param filename: name of the data file
+        :return: list of model names
+        '''
+        load_directory = self.load_directory(filename)
+        if load_directory is None:
+            return []
+
+        # models saved by another process change the modification time of the directory
+        mtime, models = self.index()[os.path.basename(load_directory)]
+        if os.stat(load_directory).st_mtime_ns != mtime:
+            with self._lock:
+                self._index = None
+            mtime, models = self.index()[os.path.basename(load_directory)]
+        return models
+
+    def load(self, filename: str, modelname: str):
+        '''
+        This method returns the model of a data file, from the cache if the model file did not change.
+
+        :param filename: name of the data file
+        :param modelname: name of the model, e.g. KMeans or XGBoost0
+        :return: the deserialized model
+        '''
+        load_directory = self.load_directory(filename)
+        if load_directory is None:
+            raise Exception(f'No valid model load directory found for {filename}')
+
+        model_file = os.path.join(load_directory, modelname, modelname + '.sav')
+        stat = os.stat(model_file)
+        key = (model_file, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        with open(model_file, 'rb') as f:
+            model = pickle.load(f)
+
+        with self._lock:
+            self._cache[key] = model
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return model
+
+    def version(self):
+        '''
+        This method computes the version of the saved models, a digest of the path, modification time
+        and size of every model file. It changes whenever a model is saved, added or removed.
+
+        :return: hex digest
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        if os.path.isdir(self.model_directory):
+            for directory in sorted(os.listdir(self.model_directory)):
+                if not self.regex.match(directory):
+                    continue
+                for root, dirs, files in sorted(os.walk(os.path.join(self.model_directory, directory))):
+                    for file in sorted(files):
+                        stat = os.stat(os.path.join(root, file))
+                        digest.update(f'{root}/{file}:{stat.st_mtime_ns}:{stat.st_size};'.encode())
+        return digest.hexdigest()
+
+    def preload(self):
+        '''
+        This method loads every model of every data set into the cache, e.g. before a worker forks.
+        The cache is grown to hold all of them, so no preloaded model is evicted by another.
+
+        :return: number of models loaded
+        '''
+        index = self.index()
+        with self._lock:
+            self.maxsize = max(self.maxsize, sum(len(models) for _, models in index.values()))
+
+        count = 0
+        for directory, (_, models) in index.items():
+            for modelname in models:
+                self.load(directory, modelname)
+                count += 1
+        return count
+
+    def invalidate(self, directory: str = None):
+        '''
+        This method drops the index and the cached models of a model directory, or everything.
+
+        :param directory: path of the data set model directory, None to clear the whole registry
+        :return: None
+        '''
+        with self._lock:
+            self._index = None
+            if directory is None:
+                self._cache.clear()
+                return
+            prefix = os.path.join(directory, '')
+            for key in [key for key in self._cache if key[0].startswith(prefix)]:
+                del self._cache[key]
+
+
+# registry shared by all File_Operation objects of the process
+registry = ModelRegistry()
@@ -0,0 +1,145 @@
+'''
+This module keeps the prediction output files of past prediction runs on disk, keyed by a digest of
+the input files and the version of the saved models, so that a run over the same files with the
+same models copies the saved output instead of predicting again.
+'''
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+from file_operations.model_registry import registry
+
+
+class ResultCache:
+    """
+        This class stores the output files of prediction runs in a directory per key. Entries older than
+        ttl seconds are not used, and the least recently used entries are removed beyond max_entries.
+
+        directory: directory of the cache entries
+        ttl: seconds an entry is used for, from the PREDICTION_CACHE_TTL environment variable by default
+        max_entries: number of entries kept, from the PREDICTION_CACHE_ENTRIES environment variable by default,
+                     0 disables the cache
+    """
+
+    def __init__(self, directory: str = 'Prediction_cache', ttl: float = None, max_entries: int = None):
+        self.directory = directory
+        self.ttl = float(os.getenv('PREDICTION_CACHE_TTL', '86400')) if ttl is None else ttl
+        self.max_entries = int(os.getenv('PREDICTION_CACHE_ENTRIES', '16')) if max_entries is None else max_entries
+
+    @property
+    def enabled(self):
+        '''
+        True if the cache keeps any entries.
+        '''
+        return self.max_entries > 0
+
+    @staticmethod
+    def digest_files(digest, path: str):
+        '''
+        This method adds the names and contents of the files in a directory tree to a digest.
+
+        :param digest: hashlib object
+        :param path: directory, a missing directory adds nothing
+        :return: None
+        '''
+        for root, dirs, files in sorted(os.walk(path)):
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                digest.update(os.path.relpath(file_path, path).encode() + b'\0')
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+
+    def key(self, *paths: str):
+        '''
+        This method computes the key of a prediction run, a digest of the files in the input
+        directories and of the version of the saved models.
+
+        :param paths: input directories of the run
+        :return: hex digest
+        '''
+        digest = hashlib.blake2b(digest_size=20)
+        for path in paths:
+            digest.update(path.encode() + b'\0')
+            self.digest_files(digest, path)
+        digest.update(registry.version().encode())
+        return digest.hexdigest()
+
+    def restore(self, key: str, output_dir: str):
+        '''
+        This method copies the output files of an entry into the output directory.
+
+        :param key: key of the run
+        :param output_dir: directory the output files are copied to
+        :return: list of the files copied, None if there is no valid entry for the key
+        '''
+        entry = os.path.join(self.directory, key)
+        if not self.enabled or not os.path.isdir(entry):
+            return None
+        if time.time() - os.stat(entry).st_mtime > self.ttl:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        os.makedirs(output_dir, exist_ok=True)
+        files = sorted(os.listdir(entry))
+        for file in files:
+            shutil.copy2(os.path.join(entry, file), os.path.join(output_dir, file))
+        # the modification time of the entry tells when it was last used
+        os.utime(entry)
+        return files
+
+    def store(self, key: str, output_dir: str, since: float = 0):
+        '''
+        This method saves the output files of a run as the entry of its key and evicts old entries.
+
+        :param key: key of the run
+        :param output_dir: directory of the output files
+        :param since: only the files modified at or after this time are part of the run
+        :return: list of the files saved
+        '''
+        if not self.enabled or not os.path.isdir(output_dir):
+            return []
+
+        files = [file for file in sorted(os.listdir(output_dir))
+                 if os.path.isfile(os.path.join(output_dir, file))
+                 and os.stat(os.path.join(output_dir, file)).st_mtime >= since]
+
+        # written to a temporary directory first, a reader never sees half an entry
+        temp = os.path.join(self.directory, f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(temp)
+        for file in files:
+            shutil.copy2(os.path.join(output_dir, file), os.path.join(temp, file))
+
+        entry = os.path.join(self.directory, key)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(temp, entry)
+        except OSError:
+            # stored by another run meanwhile
+            shutil.rmtree(temp, ignore_errors=True)
+
+        self.evict()
+        return files
+
+    def evict(self):
+        '''
+        This method removes the expired entries and the least recently used entries beyond max_entries.
+
+        :return: number of entries removed
+        '''
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.startswith('.') and os.path.isdir(path):
+                entries.append((os.stat(path).st_mtime, path))
+        entries.sort(reverse=True)
+
+        removed = 0
+        for position, (mtime, path) in enumerate(entries):
+            if position >= self.max_entries or now - mtime > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
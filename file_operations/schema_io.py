@@ -0,0 +1,78 @@
+'''
+This module reads the data files of the project with the column dtypes given in the schema files,
+so that pandas never has to infer them.
+'''
+import json
+import os
+
+import pandas as pd
+
+# physical dtypes of the schema column types, used when the schema file has no PhysicalDtypes
+SCHEMA_DTYPES = {'DECIMAL': 'float64', 'DOUBLE': 'float64', 'FLOAT': 'float32', 'INT': 'int64'}
+
+# dtypes of the compact mode, half the memory of the default ones
+COMPACT_DTYPES = {'float64': 'float32', 'int64': 'int32'}
+
+
+def compact_mode() -> bool:
+    '''
+    This function returns if the compact dtypes are enabled with the COMPACT_DTYPES environment variable.
+
+    :return: True if the files are read with float32 and int32 columns
+    '''
+    return os.getenv('COMPACT_DTYPES', '').lower() in ('1', 'true', 'yes')
+
+
+def load_schema(schema_path: str) -> dict:
+    '''
+    This function loads a schema file.
+
+    :param schema_path: path of schema_training.json or schema_prediction.json
+    :return: dict of the schema
+    '''
+    with open(schema_path, 'r', encoding='utf-8') as schema:
+        return json.load(schema)
+
+
+def column_dtypes(schema: dict, compact: bool = None) -> dict:
+    '''
+    This function returns the physical dtype of every column of the schema, in column order.
+
+    :param schema: dict of the schema
+    :param compact: read float32 and int32 columns instead of float64 and int64, None to use compact_mode
+    :return: dict of column name to numpy dtype
+    '''
+    if compact is None:
+        compact = compact_mode()
+
+    dtypes = schema.get('PhysicalDtypes') or \
+        {column: SCHEMA_DTYPES[col_type.upper()] for column, col_type in schema['ColName'].items()}
+    if compact:
+        dtypes = {column: COMPACT_DTYPES.get(dtype, dtype) for column, dtype in dtypes.items()}
+    return dtypes
+
+
+def read_csv(path, schema: dict, names: bool = True, compact: bool = None, skip_rows: int = 0, **kwargs):
+    '''
+    This function reads a data file with the dtypes of the schema.
+
+    :param path: path of the file
+    :param schema: dict of the schema
+    :param names: name the columns after the schema, the dtypes are matched by position if False.
+                  A header line with the schema column names is skipped.
+    :param compact: read float32 and int32 columns, None to use compact_mode
+    :param skip_rows: number of data rows skipped, after the header line if there is one
+    :param kwargs: passed on to pandas.read_csv, e.g. sep or iterator
+    :return: DataFrame, or a TextFileReader for iterator=True
+    '''
+    dtypes = column_dtypes(schema, compact)
+    if not names:
+        return pd.read_csv(path, header=None, dtype=dict(enumerate(dtypes.values())),
+                           skiprows=skip_rows or None, **kwargs)
+
+    columns = list(dtypes)
+    with open(path, 'r', encoding='utf-8') as file:
+        header = 0 if file.readline().startswith(columns[0]) else None
+    if skip_rows:
+        kwargs['skiprows'] = range(1, skip_rows + 1) if header == 0 else skip_rows
+    return pd.read_csv(path, header=header, names=columns, dtype=dtypes, **kwargs)
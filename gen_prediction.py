@@ -1,19 +1,38 @@
 '''
-    Higher level function to fetch database files and generate prediction output.
+    Higher level functions to fetch database files and generate prediction output, in one job
+    or sharded over the jobs of several workers.
 '''
 import os
+import time
+import pandas as pd
+from rq import get_current_job
+from rq.job import Dependency, Job
 from application_logging import logger
+from data_preprocessing.column_stats import ColumnStats
+from data_preprocessing.preprocessing import Preprocessor
+from data_ingestion.data_loader import DataGetter
+from file_operations.file_methods import File_Operation
+from file_operations.result_cache import ResultCache
+from job_events import enqueue_call
 from prediction_validation_insertion import PredictionValidation
 from predict_from_model import Prediction
 
+# largest number of rows of a shard of a sharded prediction
+SHARD_ROWS = int(os.getenv('SHARD_ROWS', '20000'))
+
 
 # define the prediction generator
-def gen_prediction(path):
+def gen_prediction(path, row_budget=None):
     '''
     This function generates prediction of remaining useful life from the datasets present at path.
 
     :param path: path containing prediction datasets
+    :param row_budget: read the data sets in chunks of whole units of at most this many rows,
+                       None to read whole files
     :return: None
+
+    The output of a run is cached with a key of the files at path and in Prediction_FileFromDB and of
+    the saved models, a later run with the same files and models copies it instead of predicting.
     '''
 
     errors = []
@@ -25,13 +44,29 @@ def gen_prediction(path):
     file_object = open("Prediction_Logs/ModelPredictionLog.txt", 'a+', encoding='utf-8')
 
     try:
+        cache = ResultCache()
+        if cache.enabled:
+            key = cache.key(path, 'Prediction_FileFromDB')
+            files = cache.restore(key, 'Prediction_output')
+            if files is not None:
+                log_writer.log(file_object, f'Restored cached predictions {files} of run {key}.')
+                return 'Predictions saved successfully.'
+        start = time.time()
+
         log_writer.log(file_object, 'Importing prediction files.')
-        validator = PredictionValidation(path)
-        validator.pred_validation()
+        validator = PredictionValidation()
+        validator.pred_validation(path)
 
         log_writer.log(file_object, 'Importing finished. Start Prediction process')
-        predictor =  Prediction(file_object, log_writer)
-        predictor.prediction_from_model()
+        predictor =  Prediction('Prediction_FileFromDB')
+        if row_budget:
+            predictor.prediction_from_chunks(row_budget)
+        else:
+            predictor.prediction_from_model()
+
+        if cache.enabled:
+            files = cache.store(key, 'Prediction_output', since=start)
+            log_writer.log(file_object, f'Cached predictions {files} of run {key}.')
 
     except Exception as Ex:
         errors.append('Unable to generate predictions.')
@@ -44,3 +79,135 @@ def gen_prediction(path):
         file_object.close()
 
 
+def plan_shards(shard_rows, path='Prediction_FileFromDB'):
+    '''
+    This function splits the prediction data sets at path into shards, one per file, and files with
+    more than shard_rows rows into row ranges of whole engine units of at most shard_rows rows.
+    A file whose models were trained without a saved preprocessing pipeline is never split, its
+    preprocessing is fitted on the whole file.
+
+    :param shard_rows: largest number of rows of a shard, unless a single unit is longer
+    :param path: path containing the prediction data sets exported from the database
+    :return: list of (file, first row, end row), the rows are None for a whole file
+    '''
+    log_writer = logger.App_Logger()
+    with open("Prediction_Logs/ModelPredictionLog.txt", 'a+', encoding='utf-8') as file_object:
+        data_getter = DataGetter(file_object, log_writer, mode='predict', path=path)
+        predictor = Prediction(path)
+
+        shards = []
+        for file in sorted(data_getter.get_files()):
+            filename = file.split('.')[0]
+            pipeline = predictor.load_pipeline(File_Operation(file_object, log_writer, filename), file_object)
+            ranges = data_getter.unit_chunks(data_getter.get_units(file), shard_rows)
+            if len(ranges) <= 1 or pipeline is None:
+                shards.append((file, None, None))
+            else:
+                shards.extend((file, start, end) for start, end in ranges)
+            log_writer.log(file_object, f'Planned {len(shards)} prediction shards up to {filename}.')
+        return shards
+
+
+def validate_batch(path):
+    '''
+    This function validates the prediction datasets present at path, the first job of a sharded prediction.
+
+    :param path: path containing prediction datasets
+    :return: None
+    '''
+    validator = PredictionValidation()
+    validator.pred_validation(path)
+
+
+def predict_shard(file, start=None, end=None, validation_id=None, path='Prediction_FileFromDB'):
+    '''
+    This function predicts the remaining useful life of the units in the rows start to end of a prediction
+    data set, the job of a shard. The result is returned to the merge job through Redis, with the column
+    statistics of the shard from which the merge job writes the null value report of the file.
+
+    :param file: name of the data set file at path
+    :param start: first row of the shard, None for the whole file
+    :param end: end row of the shard
+    :param validation_id: id of the validation job the shard depends on, the shard fails without
+                          predicting if the validation did not finish
+    :param path: path containing the prediction data sets exported from the database
+    :return: Series of the predicted rul indexed by unit_nr, ColumnStats of the predicted columns
+    '''
+    if validation_id is not None:
+        validation = Job.fetch(validation_id, connection=get_current_job().connection)
+        if validation.get_status() != 'finished':
+            raise Exception(f'Validation of the prediction files ended with status {validation.get_status()}.')
+
+    log_writer = logger.App_Logger()
+    with open("Prediction_Logs/ModelPredictionLog.txt", 'a+', encoding='utf-8') as file_object:
+        data_getter = DataGetter(file_object, log_writer, mode='predict', path=path)
+        data = data_getter.read_file(file) if start is None else data_getter.get_rows(file, start, end)
+        log_writer.log(file_object, f'Predicting shard of {len(data)} rows of {file}.')
+        stats = ColumnStats()
+        rul = Prediction(path).predict_file(data, file.split('.')[0], file_object, stats)
+        return rul, stats
+
+
+def merge_shards(validation_id, shard_ids):
+    '''
+    This function saves the predictions of the shard jobs of a sharded prediction to Prediction_output,
+    once all of them ended. It fails if the validation or a shard failed.
+
+    :param validation_id: id of the validation job
+    :param shard_ids: ids of the shard jobs
+    :return: message of the outcome
+    '''
+    connection = get_current_job().connection
+    validation = Job.fetch(validation_id, connection=connection)
+    if validation.get_status() != 'finished':
+        raise Exception(f'Validation of the prediction files ended with status {validation.get_status()}.')
+
+    # file name: (predictions of its shards, column statistics)
+    files = {}
+    for job in Job.fetch_many(shard_ids, connection=connection):
+        if job is None or job.get_status() != 'finished':
+            raise Exception(f'Prediction shard {job.args if job else None} did not finish.')
+        rul, stats = job.result
+        predictions, file_stats = files.setdefault(job.args[0].split('.')[0], ([], ColumnStats()))
+        predictions.append(rul)
+        file_stats.merge(stats)
+
+    log_writer = logger.App_Logger()
+    with open("Prediction_Logs/ModelPredictionLog.txt", 'a+', encoding='utf-8') as file_object:
+        preprocessor = Preprocessor(file_object, log_writer)
+        for filename, (predictions, file_stats) in files.items():
+            if file_stats.null_count.any():
+                preprocessor.write_null_report(file_stats.null_count, filename)
+            file_loader = File_Operation(file_object, log_writer, filename)
+            file_loader.save_prediction(pd.concat(predictions).sort_index(), filename)
+            log_writer.log(file_object, f'Saved predictions of {len(predictions)} shards for file {filename}.')
+
+    return 'Predictions saved successfully.'
+
+
+def enqueue_sharded_prediction(queue, path, shard_rows=SHARD_ROWS, job_id=None, result_ttl=1000):
+    '''
+    This function enqueues a prediction of the datasets present at path as a validation job, one job per
+    shard (see plan_shards) and a merge job that depends on all of them, so that the shards are
+    predicted by all the workers of the queue at once.
+
+    :param queue: Redis queue object
+    :param path: path containing prediction datasets
+    :param shard_rows: largest number of rows of a shard
+    :param job_id: id of the merge job
+    :param result_ttl: seconds the result of the merge job is kept
+    :return: the merge Job, its status and result are those of the whole prediction
+    '''
+    # results of the shards are kept until the merge job read them
+    shard_ttl = 3600
+    validation = queue.enqueue_call(validate_batch, args=(path, ), result_ttl=shard_ttl)
+    # the shards run once the validation ended and check that it finished, so that the merge job
+    # below still runs and reports the failure if the validation failed
+    shards = [queue.enqueue_call(predict_shard, args=shard, kwargs={'validation_id': validation.id},
+                                 depends_on=Dependency(jobs=[validation], allow_failure=True),
+                                 result_ttl=shard_ttl)
+              for shard in plan_shards(shard_rows)]
+
+    return enqueue_call(queue, merge_shards, args=(validation.id, [shard.id for shard in shards]),
+                        depends_on=Dependency(jobs=[validation] + shards, allow_failure=True),
+                        job_id=job_id, result_ttl=result_ttl)
@@ -0,0 +1,363 @@
+'''
+Event driven completion and deduplication of the Redis queue jobs.
+
+Jobs publish their status on a Redis channel of the job: the workers of worker.py when they start
+a job, and the success and failure callbacks of the jobs enqueued with enqueue_call when it ends.
+wait_for_job and JobEventHub sleep on
+these channels instead of polling the job status back to back, and check the status with an
+exponential backoff in case a notification is missed, e.g. for jobs enqueued without the
+callbacks. JobEventHub serves all the waiters of an asyncio process from one shared subscription.
+
+claim_job and enqueue_once attach a request to the queued or running job of an identical
+request, if any.
+'''
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from base64 import b64decode
+
+from redis.exceptions import WatchError
+from rq.job import Job
+from rq.serializers import resolve_serializer
+
+# statuses after which a job does not change anymore, None for a job that expired or was deleted
+FINAL_STATUSES = ('finished', 'failed', 'stopped', 'canceled', None)
+
+
+def job_channel(job_id: str) -> str:
+    '''
+    This function returns the name of the channel the status of a job is published on.
+
+    :param job_id: id of the job
+    :return: channel name
+    '''
+    return f'rul:job-events:{job_id}'
+
+
+def publish_status(connection, job_id: str, status: str):
+    '''
+    This function publishes the status of a job to its waiters.
+
+    :param connection: Redis connection object
+    :param job_id: id of the job
+    :param status: status of the job
+    :return: number of clients that received the status
+    '''
+    return connection.publish(job_channel(job_id), status)
+
+
+def notify_finished(job, connection, result, *args, **kwargs):
+    '''
+    Success callback of the jobs, run by the worker once the job function returned.
+    '''
+    publish_status(connection, job.id, 'finished')
+
+
+def notify_failed(job, connection, *exc_info):
+    '''
+    Failure callback of the jobs, run by the worker once the job function raised.
+    '''
+    publish_status(connection, job.id, 'failed')
+
+
+def enqueue_call(queue, func, args=None, **kwargs):
+    '''
+    This function enqueues a job that notifies its waiters when it finishes or fails.
+
+    :param queue: Redis queue object
+    :param func: Callable to enqueue
+    :param args: arguments passed to callable
+    :param kwargs: passed on to Queue.enqueue_call, e.g. timeout or result_ttl
+    :return: the Job
+    '''
+    return queue.enqueue_call(func, args, on_success=notify_finished, on_failure=notify_failed, **kwargs)
+
+
+def job_fingerprint(func, args=None, kwargs=None) -> str:
+    '''
+    This function computes the fingerprint of a job request from the function and its arguments.
+    Bound methods are identified by their class and name, not by the state of their instance.
+
+    :param func: Callable of the job
+    :param args: arguments passed to callable
+    :param kwargs: keyword arguments passed to callable
+    :return: hex digest
+    '''
+    name = f'{func.__module__}.{func.__qualname__}'
+    request = json.dumps([name, list(args or ()), kwargs or {}], sort_keys=True, default=str)
+    return hashlib.blake2b(request.encode(), digest_size=16).hexdigest()
+
+
+def release_claim(connection, claim: str, job_id: str):
+    '''
+    This function deletes the claim of a fingerprint if it still holds the given job id, a claim
+    replaced by another request is kept.
+
+    :param connection: Redis connection object
+    :param claim: key of the claim
+    :param job_id: id of the job the claim is released for
+    '''
+    with connection.pipeline() as pipe:
+        try:
+            pipe.watch(claim)
+            if decode_status(pipe.get(claim)) == job_id:
+                pipe.multi()
+                pipe.delete(claim)
+                pipe.execute()
+        except WatchError:
+            pass
+
+
+def claim_job(connection, fingerprint: str, enqueue, claim_ttl: int = 3600, claim_grace: float = 60):
+    '''
+    This function enqueues the job of a request unless the job of an identical request is queued or
+    running already, in which case that job is returned, so identical requests share one run and its
+    result. The job of a fingerprint is claimed with an atomic SET NX, concurrent requests can not
+    both enqueue it. A claim without its job is taken for a job being enqueued for claim_grace
+    seconds, e.g. while the shards of a sharded prediction are planned.
+
+    :param connection: Redis connection object
+    :param fingerprint: fingerprint of the request, see job_fingerprint
+    :param enqueue: function of a job id that enqueues the job of the request with that id
+    :param claim_ttl: seconds after which the claim of a fingerprint expires in any case
+    :param claim_grace: seconds after which a claim without its job is released
+    :return: the Job, True if it was enqueued by this call
+    '''
+    claim = f'rul:job-fingerprint:{fingerprint}'
+
+    for _ in range(20):
+        job_id = uuid.uuid4().hex
+        if connection.set(claim, job_id, nx=True, ex=claim_ttl):
+            try:
+                return enqueue(job_id), True
+            except Exception:
+                # the job was not enqueued, identical requests must not wait for it
+                release_claim(connection, claim, job_id)
+                raise
+
+        claimed = decode_status(connection.get(claim))
+        if claimed is None:
+            continue
+        status = decode_status(connection.hget(Job.key_for(claimed), 'status'))
+        if status is None:
+            # the claiming request may not have enqueued its job yet, the job is attached to by its id
+            remaining = connection.ttl(claim)
+            if remaining >= 0 and claim_ttl - remaining < claim_grace:
+                return Job(claimed, connection=connection), False
+        elif status not in FINAL_STATUSES:
+            return Job.fetch(claimed, connection=connection), False
+
+        # the claimed job is done or gone, release the claim unless another request replaced it
+        release_claim(connection, claim, claimed)
+
+    raise RuntimeError(f'Unable to enqueue the job of request {fingerprint}, it is claimed concurrently.')
+
+
+def enqueue_once(queue, func, args=None, claim_ttl: int = 3600, claim_grace: float = 60, **kwargs):
+    '''
+    This function enqueues a job unless an identical job is queued or running already, see claim_job.
+
+    :param queue: Redis queue object
+    :param func: Callable to enqueue
+    :param args: arguments passed to callable
+    :param claim_ttl: seconds after which the claim of a fingerprint expires in any case
+    :param claim_grace: seconds after which a claim without its job is released
+    :param kwargs: passed on to Queue.enqueue_call, e.g. timeout or result_ttl
+    :return: the Job, True if it was enqueued by this call
+    '''
+    fingerprint = job_fingerprint(func, args, kwargs.get('kwargs'))
+    return claim_job(queue.connection, fingerprint,
+                     lambda job_id: enqueue_call(queue, func, args, job_id=job_id, **kwargs), claim_ttl, claim_grace)
+
+
+def decode_status(status):
+    '''
+    This function converts the raw status of a job hash to a string, None if the job does not exist.
+    '''
+    return status.decode() if isinstance(status, bytes) else status
+
+
+async def fetch_result(connection, job_id: str):
+    '''
+    This function reads the return value of a finished job with a redis.asyncio connection, from the job
+    hash, or from the latest result of the job on rq versions that keep the results in a stream.
+
+    :param connection: redis.asyncio connection object
+    :param job_id: id of the job
+    :return: the return value, None if there is none
+    '''
+    serializer = resolve_serializer(None)
+    result = await connection.hget(Job.key_for(job_id), 'result')
+    if result is not None:
+        return serializer.loads(result)
+
+    latest = await connection.xrevrange(f'rq:results:{job_id}', count=1)
+    if latest:
+        (_, payload), = latest
+        result = payload.get(b'return_value')
+        if result is not None:
+            return serializer.loads(b64decode(result))
+    return None
+
+
+def wait_for_job(job_id: str, connection, max_wait: float = 400,
+                 min_interval: float = 0.05, max_interval: float = 5.0):
+    '''
+    This function waits until a job reaches a final status or max_wait seconds passed.
+    The callbacks run just before the worker stores the final status, so after a notification
+    the status is checked again every min_interval seconds.
+
+    :param job_id: id of the job
+    :param connection: Redis connection object
+    :param max_wait: maximum time to wait for the job in seconds
+    :param min_interval: first interval between two status checks in seconds
+    :param max_interval: largest interval between two status checks without notification in seconds
+    :return: the last status of the job
+    '''
+    deadline = time.monotonic() + max_wait
+    interval = min_interval
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    try:
+        # subscribe before checking the status, a notification in between is not lost
+        pubsub.subscribe(job_channel(job_id))
+        while True:
+            status = decode_status(connection.hget(Job.key_for(job_id), 'status'))
+            remaining = deadline - time.monotonic()
+            if status in FINAL_STATUSES or remaining <= 0:
+                return status
+
+            if pubsub.get_message(timeout=min(interval, remaining)) is not None:
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+    finally:
+        pubsub.close()
+
+
+class JobEventHub:
+    """
+        This class shares one Redis subscription to the status channels of all jobs among the asyncio
+        tasks of a process, e.g. the clients of the FastAPI backend waiting for their jobs. The
+        subscription is opened with the first waiter and every notification is handed to the waiters
+        of its job.
+
+        connection: redis.asyncio connection object
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # job id: set of the asyncio queues of the waiters of the job
+        self.listeners = {}
+        self.task = None
+        self.ready = None
+
+    async def start(self):
+        '''
+        This method opens the shared subscription if it is not open yet and waits until it listens,
+        for at most a second. The waiters fall back to polling the status while it does not.
+
+        :return: None
+        '''
+        if self.task is None or self.task.done():
+            self.ready = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.listen())
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    async def listen(self):
+        '''
+        This method receives the status notifications of all jobs and puts them into the queues of
+        their waiters. The subscription is opened again after a connection error.
+
+        :return: None
+        '''
+        prefix = job_channel('')
+        while True:
+            pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(job_channel('*'))
+                self.ready.set()
+                async for message in pubsub.listen():
+                    job_id = decode_status(message['channel'])[len(prefix):]
+                    for queue in self.listeners.get(job_id, ()):
+                        queue.put_nowait(decode_status(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.ready.clear()
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.close()
+
+    async def close(self):
+        '''
+        This method closes the shared subscription.
+
+        :return: None
+        '''
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def events(self, job_id: str, max_wait: float = 400,
+                     min_interval: float = 0.05, max_interval: float = 5.0):
+        '''
+        This method yields the status of a job every time it changes, until the job reaches a final status
+        or max_wait seconds passed. The status is read when a notification of the job arrives, and with
+        an exponential backoff in case a notification is missed (see wait_for_job).
+
+        :param job_id: id of the job
+        :param max_wait: maximum time to wait for the job in seconds
+        :param min_interval: first interval between two status checks in seconds
+        :param max_interval: largest interval between two status checks without notification in seconds
+        :return: async generator of the statuses of the job
+        '''
+        queue = asyncio.Queue()
+        self.listeners.setdefault(job_id, set()).add(queue)
+        try:
+            # listening before the first status check, a notification in between is not lost
+            await self.start()
+            deadline = time.monotonic() + max_wait
+            interval = min_interval
+            last = ''
+            while True:
+                status = decode_status(await self.connection.hget(Job.key_for(job_id), 'status'))
+                if status != last:
+                    yield status
+                    last = status
+                remaining = deadline - time.monotonic()
+                if status in FINAL_STATUSES or remaining <= 0:
+                    return
+
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=min(interval, remaining))
+                    interval = min_interval
+                except asyncio.TimeoutError:
+                    interval = min(interval * 2, max_interval)
+        finally:
+            self.listeners[job_id].discard(queue)
+            if not self.listeners[job_id]:
+                del self.listeners[job_id]
+
+    async def wait(self, job_id: str, max_wait: float = 400, **kwargs):
+        '''
+        This method is wait_for_job for asyncio, it waits until a job reaches a final status or
+        max_wait seconds passed.
+
+        :param job_id: id of the job
+        :param max_wait: maximum time to wait for the job in seconds
+        :param kwargs: min_interval and max_interval of events
+        :return: the last status of the job
+        '''
+        status = None
+        async for status in self.events(job_id, max_wait, **kwargs):
+            pass
+        return status
@@ -3,13 +3,22 @@ This is the Entry point for Training the Machine Learning Model.
 """
 # Doing the necessary imports
 import os
+import numpy as np
 import pandas as pd
 from data_ingestion import data_loader
 from data_preprocessing import preprocessing
+from data_preprocessing.column_stats import ColumnStats
 from file_operations import file_methods
 from application_logging.logger import App_Logger
 
 
+class MissingPipelineError(Exception):
+    """
+    Raised when the models of a data set were saved without the preprocessing pipeline, which
+    in process and chunked predictions need. The models have to be retrained.
+    """
+
+
 class Prediction:
     """
         This class handles the pre-processing and model prediction of data files.
@@ -31,6 +40,215 @@ class Prediction:
         file_object.close()
 
 
+    def load_pipeline(self, file_loader, file_object):
+        """
+        This method loads the preprocessing pipeline saved with the models of the data set.
+
+        Returns:
+            PreprocessingPipeline, or None if the models were trained without a compatible pipeline
+        """
+        try:
+            pipeline = file_loader.load_model('Preprocessing')
+        except FileNotFoundError:
+            self.log_writer.log(file_object,
+                                "No preprocessing pipeline saved, fitting preprocessing on prediction data.")
+            return None
+
+        if not pipeline.is_compatible():
+            self.log_writer.log(file_object,
+                                "Saved preprocessing pipeline has an old version, fitting preprocessing " +
+                                "on prediction data.")
+            return None
+
+        self.log_writer.log(file_object, f"Loaded preprocessing pipeline created {pipeline.created}.")
+        return pipeline
+
+    def predict_last_cycles(self, data, preprocessor, file_loader, pipeline, file_object):
+        """
+        This method predicts the rul at the last time cycle of every unit of the preprocessed data.
+
+        Returns:
+            Series of the predicted rul indexed by unit_nr
+        """
+        # select last rul
+        self.log_writer.log(file_object, "Select last RUL row for test data.")
+        data = preprocessor.select_last_rul(data)
+
+        # load kmeans model
+        self.log_writer.log(file_object, "Loading kmeans model.")
+        kmeans = file_loader.load_model('KMeans')
+
+        # cluster of each row of data
+        self.log_writer.log(file_object,
+                            "Finding cluster number of each row of data.")
+        clusters = kmeans.predict(data)
+
+        # sort the rows by cluster once, the rows of a cluster are then one contiguous block
+        order = np.argsort(clusters, kind='stable')
+        sorted_clusters = clusters[order]
+        sorted_values = data.to_numpy()[order]
+        bounds = np.flatnonzero(np.r_[True, sorted_clusters[1:] != sorted_clusters[:-1], True])
+
+        # predictions are scattered back to the original row order
+        rul = np.empty(len(data))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            cluster = sorted_clusters[start]
+            cluster_data = pd.DataFrame(sorted_values[start:end], columns=data.columns)
+
+            # finding model
+            self.log_writer.log(file_object,
+                                f'Finding model for cluster {cluster}')
+            model_name = file_loader.find_correct_model_file(cluster)
+
+            model = file_loader.load_model(model_name)
+
+            # scale data
+            self.log_writer.log(file_object, "Scaling numerical data")
+            if pipeline is not None:
+                cluster_data = pipeline.scale(cluster_data, cluster)
+            else:
+                cluster_data = preprocessor.scaleData(cluster_data)
+
+            rul[order[start:end]] = model.predict(cluster_data)
+            self.log_writer.log(file_object,
+                                f"Computed RUL value for cluster {cluster}")
+
+        return pd.Series(rul, index=data.index, name='RUL')
+
+    def prepare_frame(self, data, dataset, file_object, pipeline=None):
+        """
+        This method applies the preprocessing saved with the models of the data set to a DataFrame of
+        recent cycles: the training columns are selected, the cycles sorted by unit and time and the
+        missing values imputed. A prepared DataFrame has no missing values, preparing it again changes nothing.
+
+        Returns:
+            the preprocessed DataFrame
+        """
+        preprocessor = preprocessing.Preprocessor(file_object, self.log_writer)
+        if pipeline is None:
+            file_loader = file_methods.File_Operation(file_object, self.log_writer, dataset)
+            pipeline = self.load_pipeline(file_loader, file_object)
+        if pipeline is None:
+            raise MissingPipelineError(f'In process prediction needs the preprocessing pipeline of the models, '
+                            f'retrain the models of {dataset}.')
+
+        missing = [col for col in pipeline.INDEX_COLUMNS + pipeline.feature_columns
+                   if col not in data.columns]
+        if missing:
+            raise ValueError(f'Missing columns {missing} for data set {dataset}.')
+
+        # the imputers and select_last_rul expect the cycles of a unit together and in time order
+        data = data.sort_values(['unit_nr', 'time_cycles'], kind='stable')
+
+        data = pipeline.select_columns(data)
+        if data[pipeline.feature_columns].isna().to_numpy().any():
+            self.log_writer.log(file_object, "Data contains null values, imputing null values")
+            if pipeline.imputer is not None:
+                data = pipeline.impute(data)
+            else:
+                data = preprocessor.impute_missing_values(data)
+        return data
+
+    def prepare_from_frame(self, data, dataset):
+        """
+        This method is prepare_frame with its own log file, e.g. for the micro-batcher of the
+        FastAPI backend, which prepares every request before merging them.
+
+        Returns:
+            the preprocessed DataFrame
+        """
+        with open("Prediction_Logs/ModelPredictionLog.txt",
+                    'a+', encoding='utf-8') as file_object:
+            try:
+                return self.prepare_frame(data, dataset, file_object)
+            except Exception as e:
+                self.log_writer.log(file_object, f'Error: {e}')
+                raise e
+
+    def prediction_from_frame(self, data, dataset):
+        """
+        This method predicts the rul of the engine units in a DataFrame of their recent cycles, in process
+        with the models of the data set held by the model registry. The preprocessing saved with the models
+        is applied, models trained without it can not be used.
+
+        Returns:
+            Series of the predicted rul indexed by unit_nr
+        """
+        with open("Prediction_Logs/ModelPredictionLog.txt",
+                    'a+', encoding='utf-8') as file_object:
+
+            self.log_writer.log(file_object, f'Start of in process Prediction of {len(data)} rows for {dataset}.')
+            try:
+                preprocessor = preprocessing.Preprocessor(file_object, self.log_writer)
+                file_loader = file_methods.File_Operation(file_object, self.log_writer, dataset)
+                pipeline = self.load_pipeline(file_loader, file_object)
+                data = self.prepare_frame(data, dataset, file_object, pipeline)
+
+                rul = self.predict_last_cycles(data, preprocessor, file_loader, pipeline, file_object)
+                self.log_writer.log(file_object, f"Predicted {len(rul)} units of {dataset}.")
+                return rul
+
+            except Exception as e:
+                self.log_writer.log(file_object, f'Error: {e}')
+                self.log_writer.log(file_object, '!! Unsuccessful End of Prediction !!')
+                raise e
+
+    def predict_file(self, data, filename, file_object, file_stats=None):
+        """
+        This method pre processes the data of a prediction file and predicts the rul at the last time cycle
+        of its units. The preprocessing saved with the models is applied, for models trained without it the
+        preprocessing is fitted on the data, which must then hold the whole file.
+        With file_stats, the ColumnStats of the predicted columns are merged into it instead of writing the
+        null value report, for predictions of a part of a file whose report is written once for the file.
+
+        Returns:
+            Series of the predicted rul indexed by unit_nr
+        """
+        self.log_writer.log(file_object, "Initialize Preprocessor class.")
+        preprocessor = preprocessing.Preprocessor(file_object, self.log_writer)
+        file_loader = file_methods.File_Operation(file_object,
+                                                self.log_writer, filename)
+
+        # preprocessing fitted at training time, None for models trained without it
+        pipeline = self.load_pipeline(file_loader, file_object)
+
+        # one statistics pass shared by the zero deviation and the null value checks
+        stats = preprocessor.column_stats(data)
+
+        if pipeline is not None:
+            self.log_writer.log(file_object, "Selecting the columns used at training.")
+            data = pipeline.select_columns(data)
+        else:
+            self.log_writer.log(file_object, "Dropping redundant setting columns.")
+            data = preprocessor.drop_redundant_settings(data)
+
+            self.log_writer.log(file_object,
+                                "Dropping sensor columns acc to data visualisation/eda.")
+            data = preprocessor.drop_sensor(data, filename)
+
+            self.log_writer.log(file_object,
+                                "Dropping columns with zero standard deviation.")
+            data = preprocessor.drop_columns_with_zero_std_deviation(data, stats)
+
+        if file_stats is not None:
+            file_stats.merge(stats.select(data.columns))
+
+        # impute null values
+        self.log_writer.log(file_object, "Checking data for null values.")
+        if preprocessor.is_null_present(data, filename, stats, report=file_stats is None):
+            self.log_writer.log(file_object,
+                        "Data contains columns with null values, imputing null values")
+
+            if pipeline is not None and pipeline.imputer is not None:
+                data = pipeline.impute(data)
+            else:
+                data = preprocessor.impute_missing_values(data)
+        else:
+            self.log_writer.log(file_object,
+                                "No columns with null values found in data.")
+
+        return self.predict_last_cycles(data, preprocessor, file_loader, pipeline, file_object)
+
     def prediction_from_model(self):
         """
         This method pre processes all the prediction files and generates rul prediction for them
@@ -57,75 +275,81 @@ class Prediction:
 
                     self.log_writer.log(file_object, f"Loaded data from {filename}.")
 
-                    self.log_writer.log(file_object, "Initialize Preprocessor class.")
-                    preprocessor = preprocessing.Preprocessor(file_object, self.log_writer)
-
-                    self.log_writer.log(file_object, "Dropping redundant setting columns.")
-                    data = preprocessor.drop_redundant_settings(data)
-
-                    self.log_writer.log(file_object,
-                                        "Dropping sensor columns acc to data visualisation/eda.")
-                    data = preprocessor.drop_sensor(data, filename)
-
-                    self.log_writer.log(file_object,
-                                        "Dropping columns with zero standard deviation.")
-                    data = preprocessor.drop_columns_with_zero_std_deviation(data)
-
-                    # impute null values
-                    self.log_writer.log(file_object, "Checking data for null values.")
-                    if preprocessor.is_null_present(data, filename):
-                        self.log_writer.log(file_object,
-                                    "Data contains columns with null values, imputing null values")
-
-                        data = preprocessor.impute_missing_values(data)
-                    else:
-                        self.log_writer.log(file_object,
-                                            "No columns with null values found in data.")
-
-                    # select last rul
-                    self.log_writer.log(file_object, "Select last RUL row for test data.")
-                    data = preprocessor.select_last_rul(data)
-
-                    # load kmeans model
-                    self.log_writer.log(file_object, "Loading kmeans model.")
                     file_loader = file_methods.File_Operation(file_object,
                                                             self.log_writer, filename)
-                    kmeans = file_loader.load_model('KMeans')
+                    rul = self.predict_file(data, filename, file_object)
+                    file_loader.save_prediction(rul, filename)
+                    self.log_writer.log(file_object, f" Saved predictions for file {filename}")
 
-                    # add cluster to data
-                    self.log_writer.log(file_object,
-                                        "Adding cluster number to each row of data.")
-                    cluster = kmeans.predict(data)
-                    data['cluster'] = cluster
+                self.log_writer.log(file_object, "Predictions saved for all files.")
+                # return true on success
+                return True
 
-                    # empty dataframe
-                    df = pd.DataFrame()
-                    for cluster in data['cluster'].unique():
-                        cluster_data = data[data['cluster'] == cluster]
-                        cluster_data = cluster_data.drop(['cluster'], axis=1)
+            except Exception as e:
+                self.log_writer.log(file_object, f'Error: {e}')
+                self.log_writer.log(file_object, '!! Unsuccessful End of Training !!')
+                raise e
 
-                        # finding model
-                        self.log_writer.log(file_object,
-                                            f'Finding model for cluster {cluster}')
-                        model_name = file_loader.find_correct_model_file(cluster)
+    def prediction_from_chunks(self, row_budget=100000):
+        """
+        This method generates rul predictions like prediction_from_model, reading the prediction files
+        in chunks of whole engine units of at most row_budget rows (see DataGetter.get_chunks), so the
+        memory used does not grow with the size of the files. The preprocessing saved with the models
+        is applied to every chunk, models trained without it can not be used.
 
-                        model = file_loader.load_model(model_name)
+        Returns:
+            True: On success, else returns None
+        """
+        with open("Prediction_Logs/ModelPredictionLog.txt",
+                    'a+', encoding='utf-8') as file_object:
 
-                        # scale data
-                        self.log_writer.log(file_object, "Scaling numerical data")
-                        cluster_data = preprocessor.scaleData(cluster_data)
+            self.log_writer.log(file_object, f'Start of chunked Prediction from models, {row_budget} rows per chunk.')
+            try:
+                # Getting the data from the source
+                self.log_writer.log(file_object, 'Start data ingestion.')
+                data_getter = data_loader.DataGetter(file_object,
+                                                        self.log_writer, mode='predict',
+                                                        path=self.prediction_path)
+                chunkgen = data_getter.get_chunks(row_budget)
+                self.log_writer.log(file_object, 'Data ingestion completed.')
 
-                        rul = model.predict(cluster_data)
-                        cluster_data['RUL'] = rul
+                preprocessor = preprocessing.Preprocessor(file_object, self.log_writer)
+                # file name: (file loader, pipeline, predicted rul of every chunk, column statistics)
+                files = {}
 
-                        # append data
-                        df = pd.concat([df, cluster_data])
-                        self.log_writer.log(file_object,
-                                            f"Computed RUL value for cluster {cluster}")
+                for data, filename in chunkgen():
 
+                    filename = filename.split('.')[0]  # redefine filename without the .csv part!
 
-                    data = data.join(df['RUL'])
-                    file_loader.save_prediction(data['RUL'], filename)
+                    if filename not in files:
+                        self.log_writer.log(file_object, f"Loading models for {filename}.")
+                        file_loader = file_methods.File_Operation(file_object,
+                                                                self.log_writer, filename)
+                        pipeline = self.load_pipeline(file_loader, file_object)
+                        if pipeline is None:
+                            raise MissingPipelineError(f'Chunked prediction needs the preprocessing pipeline of the models, '
+                                            f'retrain the models of {filename} or predict whole files.')
+                        files[filename] = (file_loader, pipeline, [], ColumnStats())
+
+                    file_loader, pipeline, predictions, file_stats = files[filename]
+
+                    data = pipeline.select_columns(data)
+                    stats = preprocessor.column_stats(data[pipeline.feature_columns])
+                    file_stats.merge(stats)
+                    if stats.null_count.any():
+                        if pipeline.imputer is not None:
+                            data = pipeline.impute(data)
+                        else:
+                            data = preprocessor.impute_missing_values(data)
+
+                    predictions.append(
+                        self.predict_last_cycles(data, preprocessor, file_loader, pipeline, file_object))
+                    self.log_writer.log(file_object, f"Predicted {len(predictions[-1])} units of {filename}.")
+
+                for filename, (file_loader, _, predictions, file_stats) in files.items():
+                    if file_stats.null_count.any():
+                        preprocessor.write_null_report(file_stats.null_count, filename)
+                    file_loader.save_prediction(pd.concat(predictions), filename)
                     self.log_writer.log(file_object, f" Saved predictions for file {filename}")
 
                 self.log_writer.log(file_object, "Predictions saved for all files.")
@@ -134,5 +358,5 @@ class Prediction:
 
             except Exception as e:
                 self.log_writer.log(file_object, f'Error: {e}')
-                self.log_writer.log(file_object, '!! Unsuccessful End of Training !!')
+                self.log_writer.log(file_object, '!! Unsuccessful End of Prediction !!')
                 raise e
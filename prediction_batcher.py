@@ -0,0 +1,156 @@
+'''
+Micro-batching of the in process predictions of the FastAPI backend.
+
+Concurrent /predict requests of the same data set that arrive within a short window are
+merged into one DataFrame, predicted with one call of the clustering and cluster models,
+and the rul of every request is handed back to the request that is awaiting it.
+'''
+import asyncio
+
+import pandas as pd
+from starlette.concurrency import run_in_threadpool
+
+
+class PredictionBatcher:
+    """
+        This class collects the prediction requests of every data set and predicts them in batches.
+
+        predict: function of (DataFrame of cycles, data set) returning the rul Series indexed by unit_nr,
+                 e.g. Prediction.prediction_from_frame. It runs in the thread pool.
+        max_delay: seconds a request waits for other requests of its data set, 0 to predict every
+                   request on its own
+        max_rows: a batch is predicted as soon as it holds this many rows
+        prepare: function of (DataFrame of cycles, data set) returning the preprocessed DataFrame, e.g.
+                 Prediction.prepare_from_frame. It is applied to every request of a batch before the
+                 requests are merged, so that the imputation of a request never depends on the others.
+    """
+
+    def __init__(self, predict, max_delay=0.005, max_rows=50000, prepare=None):
+        self.predict = predict
+        self.prepare = prepare
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        # (data set, columns): list of (DataFrame, future) of the requests waiting for the next batch
+        self.pending = {}
+        self.timers = {}
+        # batches being predicted, referenced so that their tasks are not garbage collected
+        self.tasks = set()
+
+    async def submit(self, data, dataset):
+        '''
+        This method adds a request to the next batch of its data set and waits for its prediction.
+
+        :param data: DataFrame of the cycles of the request, with a unit_nr column
+        :param dataset: name of the data set of the models
+        :return: Series of the predicted rul indexed by unit_nr
+        '''
+        if not self.max_delay:
+            return await run_in_threadpool(self.predict, data, dataset)
+
+        # only requests with the same columns are merged, a missing column must not be filled with nulls
+        key = (dataset, frozenset(data.columns))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((data, future))
+
+        if sum(len(frame) for frame, _ in batch) >= self.max_rows:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.max_delay, self.flush, key)
+        return await future
+
+    def flush(self, key):
+        '''
+        This method starts the prediction of the requests waiting for the next batch of a data set.
+
+        :param key: data set and column names of the batch
+        :return: None
+        '''
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self.pending.pop(key, [])
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.run(key[0], batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    @staticmethod
+    def merge(frames):
+        '''
+        This method concatenates the cycles of several requests. The units of every request are renumbered
+        so that units of different requests with the same unit_nr stay apart.
+
+        :param frames: list of DataFrames with a unit_nr column
+        :return: the merged DataFrame, list of the original unit_nr of the renumbered units of every request
+        '''
+        merged, units, offset = [], [], 0
+        for frame in frames:
+            codes, uniques = pd.factorize(frame['unit_nr'])
+            merged.append(frame.assign(unit_nr=codes + offset))
+            units.append(uniques)
+            offset += len(uniques)
+        return pd.concat(merged, ignore_index=True), units
+
+    @staticmethod
+    def split(rul, units):
+        '''
+        This method splits the rul predicted for a merged batch into the rul of every request, the inverse
+        of merge.
+
+        :param rul: Series of the predicted rul indexed by the renumbered unit_nr
+        :param units: list of the original unit_nr of the renumbered units of every request, from merge
+        :return: list of Series of the predicted rul indexed by unit_nr, one per request
+        '''
+        results, offset = [], 0
+        for uniques in units:
+            request_rul = rul.loc[range(offset, offset + len(uniques))]
+            request_rul.index = pd.Index(uniques, name='unit_nr')
+            offset += len(uniques)
+            results.append(request_rul.sort_index())
+        return results
+
+    async def run(self, dataset, batch):
+        '''
+        This method predicts a batch of requests and sets the result of every request. If the batch fails,
+        its requests are predicted one by one, so that a bad request fails only itself.
+
+        :param dataset: name of the data set of the models
+        :param batch: list of (DataFrame, future) of the requests
+        :return: None
+        '''
+        if len(batch) == 1:
+            (data, future), = batch
+            try:
+                rul = await run_in_threadpool(self.predict, data, dataset)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(rul)
+            return
+
+        try:
+            frames = [frame for frame, _ in batch]
+            if self.prepare is not None:
+                frames = await run_in_threadpool(lambda: [self.prepare(frame, dataset) for frame in frames])
+            data, units = self.merge(frames)
+            rul = await run_in_threadpool(self.predict, data, dataset)
+        except Exception:
+            await asyncio.gather(*(self.run(dataset, [request]) for request in batch))
+            return
+
+        try:
+            results = self.split(rul, units)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), request_rul in zip(batch, results):
+            if not future.done():
+                future.set_result(request_rul)
@@ -23,9 +23,10 @@ class PredictionValidation:
         self.log_path = "Prediction_Logs/Prediction_Main_Log.txt"
         self.log_writer = logger.App_Logger()
 
-    def pred_validation(self, path: str):
+    def pred_validation(self, path: str, parallel_workers: int = 0):
         """
         This method validates the files in path. According sorts the files in different directories.
+        With parallel_workers > 0 the files are validated in a pool of that many processes.
 
         """
         with open(self.log_path, 'a+', encoding='utf-8') as file_object:
@@ -58,19 +59,23 @@ class PredictionValidation:
                 self.log_writer.log(file_object, 'Start validation of files.')
 
                 self.log_writer.log(file_object, 'Getting values from schema file')
-                _, no_of_columns = validator.values_from_schema()
+                column_names, no_of_columns = validator.values_from_schema()
 
                 self.log_writer.log(file_object, 'Getting file name regex')
                 regex = validator.manual_regex_creation()
 
-                self.log_writer.log(file_object, 'Validating file name using regex')
-                validator.validation_filename_raw(regex)
-
-                self.log_writer.log(file_object, 'Validating number of columns')
-                validator.validate_column_length(no_of_columns)
-
-                self.log_writer.log(file_object, 'Validating if any column has all NULL values.')
-                validator.validate_missing_values_in_whole_column()
+                if parallel_workers:
+                    self.log_writer.log(file_object,
+                                        f'Validating files in parallel with {parallel_workers} processes.')
+                    validator.validate_files_parallel(regex, no_of_columns,
+                                                      max_workers=parallel_workers)
+                else:
+                    self.log_writer.log(file_object, 'Validating file name using regex')
+                    validator.validation_filename_raw(regex)
+
+                    self.log_writer.log(file_object,
+                                        'Validating number of columns and columns with all NULL values.')
+                    validator.validate_good_raw_files(no_of_columns)
 
                 self.log_writer.log(file_object, "Raw Data Validation Complete!!")
 
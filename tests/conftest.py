@@ -0,0 +1,36 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def prediction_dir(tmp_path, monkeypatch):
+    '''
+    Working directory with the prediction schema and a test_input_001.csv file of engine cycles,
+    sorted by unit_nr as exported from the database. Returns the path of the data files and the
+    DataFrame written to the csv file.
+    '''
+    shutil.copy(os.path.join(ROOT, 'schema_prediction.json'), tmp_path)
+    with open(tmp_path / 'schema_prediction.json', encoding='utf-8') as schema:
+        columns = list(json.load(schema)['ColName'])
+
+    # units of different lengths, one of them longer than the row budgets of the tests
+    lengths = [3, 5, 2, 7, 1, 4]
+    units = np.repeat(np.arange(1, len(lengths) + 1), lengths)
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(len(units), len(columns))), columns=columns)
+    data['unit_nr'] = units
+    data['time_cycles'] = np.concatenate([np.arange(1, length + 1) for length in lengths])
+
+    path = tmp_path / 'Prediction_FileFromDB'
+    path.mkdir()
+    data.to_csv(path / 'test_input_001.csv', index=False, header=False)
+
+    monkeypatch.chdir(tmp_path)
+    return str(path), data.astype('float64')
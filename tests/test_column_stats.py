@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from data_preprocessing.column_stats import ColumnStats
+
+
+def test_merged_chunks_match_whole_frame():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(loc=5, size=(1000, 4)), columns=list('abcd'))
+    data = data.mask(rng.random(data.shape) < 0.1)
+    data['constant'] = 1.0
+    data['empty'] = np.nan
+    data['name'] = 'engine'
+
+    stats = ColumnStats()
+    for start in range(0, len(data), 137):
+        stats.update(data.iloc[start:start + 137])
+    whole = ColumnStats.from_frame(data)
+
+    numeric = data.select_dtypes('number')
+    assert stats.columns == list(numeric.columns)
+    assert stats.rows == len(data)
+    pd.testing.assert_series_equal(stats.null_count, numeric.isna().sum(), check_dtype=False)
+    pd.testing.assert_series_equal(stats.std, numeric.std(), check_dtype=False)
+    pd.testing.assert_frame_equal(stats.to_frame(), whole.to_frame())
+    assert np.allclose(stats.to_frame()['mean'], numeric.mean(), equal_nan=True)
+    assert stats.is_constant() == ['constant']
+
+
+def test_merge_with_empty_chunk():
+    data = pd.DataFrame({'a': [1.0, 2.0, 4.0]})
+    stats = ColumnStats.from_frame(data).merge(ColumnStats.from_frame(data.iloc[:0]))
+    assert stats.rows == 3
+    assert np.isclose(stats.std['a'], data['a'].std())
+
+
+def test_select_merges_like_selected_frame():
+    data = pd.DataFrame({'a': [1.0, np.nan, 4.0], 'b': [np.nan, np.nan, 2.0], 'c': [3.0, 3.0, 3.0]})
+    stats = ColumnStats().merge(ColumnStats.from_frame(data.iloc[:2]).select(['c', 'b', 'missing']))
+    stats.merge(ColumnStats.from_frame(data.iloc[2:]).select(['c', 'b']))
+    pd.testing.assert_frame_equal(stats.to_frame(), ColumnStats.from_frame(data[['c', 'b']]).to_frame())
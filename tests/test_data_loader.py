@@ -0,0 +1,66 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from application_logging.logger import App_Logger
+from data_ingestion.data_loader import DataGetter
+
+
+@pytest.fixture
+def data_getter(prediction_dir):
+    path, _ = prediction_dir
+    return DataGetter(io.StringIO(), App_Logger(), mode='predict', path=path)
+
+
+def assert_whole_units(units, chunks, row_budget):
+    # the chunks cover all rows in order, and no unit is split between two chunks
+    assert [start for start, _ in chunks] == [0] + [end for _, end in chunks[:-1]]
+    assert chunks[-1][1] == len(units)
+    for start, end in chunks:
+        assert end - start <= row_budget or len(set(units[start:end])) == 1
+        if start > 0:
+            assert units[start - 1] != units[start]
+
+
+def test_unit_chunks_empty():
+    assert DataGetter.unit_chunks([], 10) == []
+    assert DataGetter.unit_chunks(np.array([], dtype='int64'), 10) == []
+
+
+def test_unit_chunks_unit_larger_than_budget():
+    units = np.array([1] * 7 + [2] * 2 + [3] * 2)
+    chunks = DataGetter.unit_chunks(units, 4)
+    assert chunks == [(0, 7), (7, 11)]
+    assert_whole_units(units, chunks, 4)
+
+    assert DataGetter.unit_chunks(np.ones(5), 2) == [(0, 5)]
+
+
+def test_unit_chunks_packs_units():
+    units = np.repeat([1, 2, 3, 4, 5, 6], [3, 5, 2, 7, 1, 4])
+    for row_budget in (1, 4, 6, 10, 100):
+        assert_whole_units(units, DataGetter.unit_chunks(units, row_budget), row_budget)
+    assert DataGetter.unit_chunks(units, 100) == [(0, len(units))]
+
+
+@pytest.mark.parametrize('row_budget', [2, 6, 9, 100])
+def test_read_csv_chunks_carries_units_over(data_getter, prediction_dir, row_budget):
+    path, data = prediction_dir
+    chunks = list(data_getter.read_csv_chunks(f'{path}/test_input_001.csv', row_budget))
+
+    for chunk in chunks:
+        assert len(chunk) <= row_budget or chunk['unit_nr'].nunique() == 1
+    units = [set(chunk['unit_nr']) for chunk in chunks]
+    assert all(not (a & b) for i, a in enumerate(units) for b in units[i + 1:])
+
+    merged = pd.concat(chunks, ignore_index=True).astype('float64')
+    pd.testing.assert_frame_equal(merged, data)
+
+
+def test_get_rows_reads_row_range(data_getter, prediction_dir):
+    _, data = prediction_dir
+    for start, end in DataGetter.unit_chunks(data['unit_nr'].to_numpy(), 6):
+        rows = data_getter.get_rows('test_input_001.csv', start, end).astype('float64')
+        pd.testing.assert_frame_equal(rows, data.iloc[start:end].reset_index(drop=True))
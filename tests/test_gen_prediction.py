@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import gen_prediction
+
+
+class StubPrediction:
+    '''
+    Prediction whose models have a saved preprocessing pipeline or not.
+    '''
+    pipeline = object()
+
+    def __init__(self, path):
+        pass
+
+    def load_pipeline(self, file_loader, file_object):
+        return self.pipeline
+
+
+@pytest.fixture
+def planner(prediction_dir, monkeypatch):
+    os.makedirs('Prediction_Logs')
+    monkeypatch.setattr(gen_prediction, 'Prediction', StubPrediction)
+    return prediction_dir
+
+
+def test_plan_shards_splits_files_into_whole_units(planner):
+    path, data = planner
+    shards = gen_prediction.plan_shards(6, path)
+
+    assert [file for file, _, _ in shards] == ['test_input_001.csv'] * len(shards)
+    ranges = [(start, end) for _, start, end in shards]
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    units = data['unit_nr'].to_numpy()
+    assert all(units[start - 1] != units[start] for start, _ in ranges[1:])
+
+
+def test_plan_shards_keeps_small_files_whole(planner):
+    path, _ = planner
+    assert gen_prediction.plan_shards(1000, path) == [('test_input_001.csv', None, None)]
+
+
+def test_plan_shards_keeps_files_without_pipeline_whole(planner, monkeypatch):
+    path, _ = planner
+    monkeypatch.setattr(StubPrediction, 'pipeline', None)
+    assert gen_prediction.plan_shards(6, path) == [('test_input_001.csv', None, None)]
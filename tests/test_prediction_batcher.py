@@ -0,0 +1,51 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from prediction_batcher import PredictionBatcher
+
+
+def request(units, lengths):
+    unit_nr = np.repeat(units, lengths)
+    return pd.DataFrame({'unit_nr': unit_nr, 'time_cycles': np.arange(len(unit_nr)) + 1,
+                         'sensor': np.arange(len(unit_nr), dtype='float64')})
+
+
+def last_sensor(data, dataset=None):
+    # a prediction of every unit that depends on its rows only
+    return data.groupby('unit_nr')['sensor'].last()
+
+
+def test_merge_split_round_trip():
+    # units with the same unit_nr in different requests, and units not sorted
+    frames = [request([3, 1], [2, 3]), request([1, 2], [4, 1]), request([7], [2])]
+    merged, units = PredictionBatcher.merge(frames)
+
+    assert len(merged) == sum(len(frame) for frame in frames)
+    assert merged['unit_nr'].nunique() == sum(frame['unit_nr'].nunique() for frame in frames)
+
+    results = PredictionBatcher.split(last_sensor(merged), units)
+    assert len(results) == len(frames)
+    for frame, rul in zip(frames, results):
+        pd.testing.assert_series_equal(rul, last_sensor(frame), check_names=False)
+        assert rul.index.name == 'unit_nr'
+
+
+def test_concurrent_requests_get_their_own_predictions():
+    frames = [request([1, 2], [3, 2]), request([2, 1], [1, 4]), request([5], [3])]
+    calls = []
+
+    def predict(data, dataset):
+        calls.append(len(data))
+        return last_sensor(data)
+
+    async def submit_all():
+        batcher = PredictionBatcher(predict, max_delay=0.05)
+        return await asyncio.gather(*(batcher.submit(frame, 'test_input_001') for frame in frames))
+
+    results = asyncio.run(submit_all())
+    # one call for the whole batch
+    assert calls == [sum(len(frame) for frame in frames)]
+    for frame, rul in zip(frames, results):
+        pd.testing.assert_series_equal(rul, last_sensor(frame), check_names=False)
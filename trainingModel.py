@@ -22,10 +22,30 @@ class trainModel:
         self.log_writer.log(self.file_object, f"Created an instance of {__class__} class.")
         self.file_object.close()
 
-    def trainingModel(self):
+    def trainingModel(self, parallel_tasks=0, cpu_budget=None, search='exhaustive', n_iter=20,
+                      early_stopping_rounds=None, impute_strategy='knn'):
+        """
+            Train the models of every data set. With parallel_tasks > 0 the model search of every
+            (data set, cluster, model family) runs in a pool of that many processes sharing
+            cpu_budget cores (all cores if None), otherwise the clusters are trained one by one.
+            search is the hyper parameter search strategy of tuner.Model_Finder, with a budget
+            of n_iter candidates for the randomized and halving searches.
+            early_stopping_rounds picks the number of rounds of the final XGBoost models on held out
+            training data, see tuner.Model_Finder, None fits all n_estimators rounds.
+            impute_strategy is the imputation of Preprocessor.impute_missing_values, 'knn' (default) over
+            the whole data set or, opt-in, one of the per unit strategies of preprocessing.UnitImputer,
+            e.g. 'interpolate'. The fitted imputer is saved in the preprocessing pipeline and reused for
+            prediction.
+        """
+        search_options = {'search': search, 'n_iter': n_iter, 'early_stopping_rounds': early_stopping_rounds}
         with open("Training_Logs/ModelTrainingLog.txt", 'a+') as self.file_object:
             self.log_writer.log(self.file_object, 'Start of Training')
+            scheduler = None
             try:
+                if parallel_tasks:
+                    scheduler = tuner.ParallelModelSearch(self.file_object, self.log_writer,
+                                                          parallel_tasks, cpu_budget, search_options)
+
                 # Getting the data from the source
                 self.log_writer.log(self.file_object, 'Start data ingestion.')
                 data_getter = data_loader.DataGetter(self.file_object, self.log_writer)
@@ -44,6 +64,9 @@ class trainModel:
                     self.log_writer.log(self.file_object, "Adding remaining useful life column to data.")
                     data = preprocessor.add_remaining_useful_life(data)
 
+                    # the units of the rows, needed by the per unit imputation
+                    units = data['unit_nr']
+
                     # drop unit_nr and time_cycles
                     self.log_writer.log(self.file_object, "Dropping unit_nr and time_cycles column")
                     data = preprocessor.remove_columns(data, ['unit_nr', 'time_cycles'])
@@ -54,27 +77,34 @@ class trainModel:
                     self.log_writer.log(self.file_object, "Dropping sensor columns acc to data visualisation/eda.")
                     data = preprocessor.drop_sensor(data, filename)
 
+                    # one statistics pass shared by the zero deviation and the null value checks
+                    stats = preprocessor.column_stats(data)
+
                     self.log_writer.log(self.file_object, "Dropping columns with zero standard deviation.")
-                    data = preprocessor.drop_columns_with_zero_std_deviation(data)
+                    data = preprocessor.drop_columns_with_zero_std_deviation(data, stats)
 
                     # impute null values
                     self.log_writer.log(self.file_object, "Checking data for null values.")
-                    if preprocessor.is_null_present(data, filename):
+                    if preprocessor.is_null_present(data, filename, stats):
                         self.log_writer.log(self.file_object,
                                             "Data contains columns with null values, imputing null values")
 
-                        data = preprocessor.impute_missing_values(data)
+                        data = preprocessor.impute_missing_values(data, exclude=['RUL'], strategy=impute_strategy,
+                                                                  groups=units)
                     else:
                         self.log_writer.log(self.file_object, "No columns with null values found in data.")
 
                     X = data.drop(['RUL'], axis=1)
                     Y = data['RUL']
 
+                    # fitted preprocessing that is saved with the models and reused for prediction
+                    pipeline = preprocessing.PreprocessingPipeline(X.columns, imputer=preprocessor.imputer)
+
                     """ Applying the clustering approach"""
 
                     self.log_writer.log(self.file_object, "Initialise data clustering.")
-                    kmeans = clustering.KMeansClustering(self.file_object,self.log_writer)
-                    number_of_clusters = kmeans.elbow_plot(X, filename)  # elbow plot
+                    kmeans = clustering.KMeansClustering(self.file_object,self.log_writer, sample_size=20000)
+                    number_of_clusters = kmeans.elbow_plot(X, filename, strata=Y)  # elbow plot
 
                     # Divide the data into clusters
                     X = kmeans.create_clusters(X,number_of_clusters, filename)
@@ -99,13 +129,22 @@ class trainModel:
                                                                             test_size=1/3, random_state=355)
                         self.log_writer.log(self.file_object, f'Scaling cluster data for cluster {i}')
                         x_train = preprocessor.scaleData(x_train)
-                        x_test = preprocessor.scaleData(x_test)
+                        pipeline.add_scaler(i, preprocessor.scaler)
+                        x_test = preprocessor.scaleData(x_test, scaler=preprocessor.scaler)
+
+                        if scheduler is not None:
+                            # tune in the pool, the model is saved once its searches are done
+                            scheduler.submit(filename, i, x_train, y_train, x_test, y_test,
+                                             units.loc[x_train.index])
+                            scheduler.save_finished()
+                            continue
 
                         self.log_writer.log(self.file_object, f'Initialize model tuning for cluster {i}')
-                        model_finder = tuner.Model_Finder(self.file_object, self.log_writer)
+                        model_finder = tuner.Model_Finder(self.file_object, self.log_writer, **search_options)
 
                         # getting the best model for each of the clusters
-                        best_model_name, best_model = model_finder.get_best_model(x_train,y_train,x_test,y_test)
+                        best_model_name, best_model = model_finder.get_best_model(x_train,y_train,x_test,y_test,
+                                                                                  units.loc[x_train.index])
 
                         # saving the best model to the directory.
                         self.log_writer.log(self.file_object,
@@ -117,9 +156,20 @@ class trainModel:
                         self.log_writer.log(self.file_object, f'Training complete for Cluster {i}')
 
                     else:
+                        self.log_writer.log(self.file_object, "Saving the fitted preprocessing pipeline.")
+                        file_op = file_methods.File_Operation(self.file_object, self.log_writer, filename)
+                        file_op.save_model(pipeline, 'Preprocessing')
                         self.log_writer.log(self.file_object, f'Training finished for the data {filename}')
                 else:
+                    if scheduler is not None:
+                        self.log_writer.log(self.file_object, "Waiting for the model searches to finish.")
+                        scheduler.wait_all()
+                    clustering.wait_for_plots()
                     self.log_writer.log(self.file_object, "Training completed for all datasets.")
 
             except Exception as e:
                 self.log_writer.log(self.file_object, '!! Unsuccessful End of Training !!')
+
+            finally:
+                if scheduler is not None:
+                    scheduler.shutdown()
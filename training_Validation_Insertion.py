@@ -5,7 +5,7 @@ import os
 
 
 class train_validation:
-    def __init__(self, path):
+    def __init__(self, path, parallel_workers=0):
         # first create the log directory before anything
         if not os.path.isdir('Training_Logs'):
             os.makedirs('Training_Logs')
@@ -13,6 +13,8 @@ class train_validation:
         self.file_object = open(self.log_path, 'a+')
         self.log_writer = logger.App_Logger()
         self.path = path
+        # number of processes used to validate the files, 0 validates them one after the other
+        self.parallel_workers = parallel_workers
         # self.raw_data = Raw_Data_validation(path)
         # self.DbOperation = DbOperation()
 
@@ -42,15 +44,20 @@ class train_validation:
             # getting the regex defined to validate filename
             self.log_writer.log(self.file_object, 'Getting file name regex')
             regex = validator.manualRegexCreation()
-            # validating filename of prediction files
-            self.log_writer.log(self.file_object, 'Validating file name using regex')
-            validator.validationFileNameRaw(regex)
-            # validating column length in the file
-            self.log_writer.log(self.file_object, 'Validating number of columns')
-            validator.validateColumnLength(noofcolumns)
-            # validating if any column has all values missing
-            self.log_writer.log(self.file_object, 'Validating if any column has all NULL values.')
-            validator.validateMissingValuesInWholeColumn()
+            if self.parallel_workers:
+                # validating file name, column length and null columns of all files in a process pool
+                self.log_writer.log(self.file_object,
+                                    f'Validating files in parallel with {self.parallel_workers} processes.')
+                validator.validateFilesParallel(regex, noofcolumns,
+                                                max_workers=self.parallel_workers)
+            else:
+                # validating filename of prediction files
+                self.log_writer.log(self.file_object, 'Validating file name using regex')
+                validator.validationFileNameRaw(regex)
+                # validating column length and columns with all values missing, reading each file once
+                self.log_writer.log(self.file_object,
+                                    'Validating number of columns and columns with all NULL values.')
+                validator.validateGoodRawFiles(noofcolumns)
             self.log_writer.log(self.file_object, "Raw Data Validation Complete!!")
 
             self.log_writer.log(self.file_object, "Starting database to csv file process.")
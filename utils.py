@@ -2,13 +2,14 @@
 This module contains various utility functions
 """
 from collections.abc import Callable
-from datetime import datetime, timedelta
 from typing import Any
 
 import streamlit as st
 from rq import Queue
 from rq.job import Job
 
+from job_events import enqueue_once, wait_for_job
+
 
 # manager function
 def manager(queue: Queue, connection,
@@ -26,45 +27,33 @@ def manager(queue: Queue, connection,
     :param args: arguments passed to callable
     :param timeout: maximum time after which job is declared to be failed
     :param max_retries: maximum times to retry after a job fails to queue properly
-    :param max_wait: maximum time to wait for a job result
+    :param max_wait: maximum time to wait for a job result, the job notifies its completion (see job_events)
     :param status_msg: message to print while the job is processing
     :param failure_msg: message to print if the job is failed
     :param success_msg: message to show if job is successful
     :return: None
     """
 
-    # enqueue the job
-    queue.empty()
-    job = queue.enqueue_call(func, args, timeout=timeout,
-                             result_ttl=300, failure_ttl=120, ttl=900, )
-
-    # check status in case the status is immediate
-    status = job.get_status()
-    start = datetime.now()
+    # enqueue the job, or attach to the identical job of another session
+    job, _ = enqueue_once(queue, func, args, timeout=timeout,
+                          result_ttl=300, failure_ttl=120, ttl=900, )
 
+    # sleep until the job finishes, fails or max_wait passed
     with st.spinner(status_msg):
-        while True:
-            if status in ['queued', 'started']:
-                status = job.get_status()
-                now = datetime.now()
-                if now - start > timedelta(seconds=max_wait):
-                    break
-                continue
-            break
+        wait_for_job(job.id, connection, max_wait=max_wait)
 
     if not job.is_finished:
         if job.is_failed:
             # show traceback
             job = Job.fetch(job.id, connection=connection)
             st.error(job.exc_info)
-            job.delete()
             raise RuntimeError(failure_msg)
 
-        # unexpected error this should not happen
+        # the job did not finish within max_wait or was stopped, it is not deleted since other sessions
+        # may share it, the retry waits for it again or enqueues a new one if it ended
         if max_retries > 0:
-            st.warning('Unexpected error occurred while processing request. Retrying')
-            job.delete()
-            return manager(queue, func, connection, args, timeout=timeout,
+            st.warning('Request has not completed yet. Retrying')
+            return manager(queue, connection, func, args, timeout=timeout,
                            max_retries=max_retries - 1,
                            max_wait=max_wait, status_msg=status_msg,
                            failure_msg=failure_msg, success_msg=success_msg)
@@ -72,6 +61,5 @@ def manager(queue: Queue, connection,
         raise RuntimeError(
             'An unexpected error has occurred while processing request.')
     else:
-        # job has finished successfully
+        # job has finished successfully, other sessions may share it so it expires with its result_ttl
         st.success(success_msg)
-        job.delete()
@@ -1,10 +1,20 @@
 '''
 Bacground worker that uses Redis queue to process requests.
+
+Worker modes, chosen with --mode or the WORKER_MODE environment variable:
+    fork:    plain rq worker, every job runs in a freshly forked work horse.
+    preload: import the prediction stack and load all models once in the parent, the forked
+             work horses share them copy-on-write.
+    simple:  preload and run every job inside the same warm process, without forking.
 '''
+import argparse
 import os
 import sys
 import redis
-from rq import Worker, Queue, Connection
+import redis.asyncio
+from rq import Worker, SimpleWorker, Queue, Connection
+
+from job_events import publish_status
 
 listen = ['default']
 
@@ -13,10 +23,53 @@ redis_url = os.getenv('REDISTOGO_URL',
 
 conn = redis.from_url(redis_url)
 
+# connection of the asyncio code of the FastAPI backend
+async_conn = redis.asyncio.from_url(redis_url)
+
+
+class EventWorker(Worker):
+    '''
+    Worker that publishes the start of every job to its waiters, the end is published by the
+    callbacks of the job, see job_events.
+    '''
+
+    def prepare_job_execution(self, job, *args, **kwargs):
+        super().prepare_job_execution(job, *args, **kwargs)
+        publish_status(self.connection, job.id, 'started')
+
+
+class SimpleEventWorker(EventWorker, SimpleWorker):
+    '''
+    SimpleWorker that publishes the start of every job to its waiters.
+    '''
+
+
+def preload():
+    '''
+    Import the heavy prediction stack and load every saved model into the model registry.
+
+    :return: number of models loaded
+    '''
+    # importing the prediction entry point pulls in pandas, sklearn and the project modules
+    import gen_prediction  # noqa: F401
+    from file_operations.model_registry import registry
+
+    return registry.preload()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Redis queue worker for prediction jobs.')
+    parser.add_argument('--mode', choices=['fork', 'preload', 'simple'],
+                        default=os.getenv('WORKER_MODE', 'preload'))
+    mode = parser.parse_args().mode
+
     try:
+        if mode in ['preload', 'simple']:
+            print(f'Preloaded {preload()} models.')
+
+        worker_class = SimpleEventWorker if mode == 'simple' else EventWorker
         with Connection(conn):
-            worker = Worker(list(map(Queue, listen)))
+            worker = worker_class(list(map(Queue, listen)))
             worker.work()
 
     except KeyboardInterrupt as interrupt: